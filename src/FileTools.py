@@ -0,0 +1,588 @@
+import os
+import shutil
+import json
+import struct
+import select
+import pathlib
+import threading
+import time
+from datetime import datetime
+
+def stateFolder(directory):
+	return pathlib.Path(directory) / '.kroz'
+
+videoExtensions = ['.flv', '.mp4', '.mov', '.mkv']
+
+def findLooseCaptures(directory):
+	# only the top level; processed/, combined/ and friends are subfolders
+	with os.scandir(directory) as entries:
+		return sorted(pathlib.Path(entry.path) for entry in entries if entry.is_file() and os.path.splitext(entry.name)[1].lower() in videoExtensions)
+
+def fileIdentity(path):
+	# changes whenever the file is replaced or rewritten, even under the same name
+	path = pathlib.Path(path)
+	stat = path.stat()
+	return '%s|%d|%d' % (path.resolve(), stat.st_size, stat.st_mtime_ns)
+
+def existingFolder(path):
+	folder = pathlib.Path(path)
+	while not folder.exists():
+		folder = folder.parent
+	return folder
+
+def isSameDevice(path, folder):
+	return os.stat(existingFolder(path)).st_dev == os.stat(existingFolder(folder)).st_dev
+
+class SpaceLedger():
+	# free space minus what running jobs have already promised to write
+	def __init__(self):
+		self.reserved = {}
+		self._lock = threading.Lock()
+
+	def available(self, path):
+		folder = existingFolder(path)
+		with self._lock:
+			return shutil.disk_usage(folder).free - self.reserved.get(os.stat(folder).st_dev, 0)
+
+	def reserve(self, path, count):
+		folder = existingFolder(path)
+		device = os.stat(folder).st_dev
+		with self._lock:
+			if shutil.disk_usage(folder).free - self.reserved.get(device, 0) < count:
+				return None
+			self.reserved[device] = self.reserved.get(device, 0) + count
+			return (device, count)
+
+	def release(self, reservation):
+		if reservation is None:
+			return
+		device, count = reservation
+		with self._lock:
+			self.reserved[device] = max(0, self.reserved.get(device, 0) - count)
+
+class Inotify():
+	# linux only; anywhere else constructing one raises OSError and callers fall back to polling
+	IN_MODIFY = 0x2
+	IN_CLOSE_WRITE = 0x8
+	IN_MOVED_FROM = 0x40
+	IN_MOVED_TO = 0x80
+	IN_CREATE = 0x100
+	IN_DELETE = 0x200
+	IN_DELETE_SELF = 0x400
+	IN_MOVE_SELF = 0x800
+	IN_Q_OVERFLOW = 0x4000
+	IN_IGNORED = 0x8000
+	IN_CLOEXEC = 0o2000000
+
+	eventHeader = struct.Struct('iIII')
+
+	def __init__(self, directory, mask):
+		if not hasattr(os, 'uname') or os.uname().sysname != 'Linux':
+			raise OSError('inotify is only available on Linux')
+
+		# only the script process watches folders, so the GUI never pays for ctypes
+		import ctypes, ctypes.util
+		libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+		self.fd = libc.inotify_init1(self.IN_CLOEXEC)
+		if self.fd < 0:
+			error = ctypes.get_errno()
+			raise OSError(error, os.strerror(error))
+
+		if libc.inotify_add_watch(self.fd, os.fsencode(str(directory)), mask) < 0:
+			error = ctypes.get_errno()
+			os.close(self.fd)
+			raise OSError(error, os.strerror(error), str(directory))
+
+	def read(self, timeout):
+		ready, _, _ = select.select([self.fd], [], [], timeout)
+		if len(ready) == 0:
+			return []
+
+		data = os.read(self.fd, 64 * 1024)
+		events = []
+		offset = 0
+		while offset + self.eventHeader.size <= len(data):
+			_, mask, _, length = self.eventHeader.unpack_from(data, offset)
+			offset += self.eventHeader.size
+			name = data[offset:offset + length].rstrip(b'\0')
+			offset += length
+			events.append((mask, os.fsdecode(name)))
+		return events
+
+	def close(self):
+		os.close(self.fd)
+
+class FolderWatcher():
+	# reports files appearing, growing and going away at the top of one folder
+	watchMask = Inotify.IN_MODIFY | Inotify.IN_CLOSE_WRITE | Inotify.IN_MOVED_FROM | Inotify.IN_MOVED_TO | Inotify.IN_CREATE | Inotify.IN_DELETE | Inotify.IN_DELETE_SELF | Inotify.IN_MOVE_SELF
+
+	def __init__(self, directory, extensions, onChange, onIdle=None, interval=1.):
+		self.directory = pathlib.Path(directory)
+		self.extensions = extensions
+		self.onChange = onChange
+		self.onIdle = onIdle
+		self.interval = interval
+
+		self.entries = {}
+		self.mode = None
+		self._wake = threading.Event()
+		self._thread = None
+		self._running = False
+
+	def start(self):
+		if self._thread is not None and self._thread.is_alive():
+			return
+
+		self._running = True
+		self._thread = threading.Thread(target=self._watch, name='FolderWatcher', daemon=True)
+		self._thread.start()
+
+	def stop(self):
+		self._running = False
+		self._wake.set()
+
+	def _matches(self, name):
+		return os.path.splitext(name)[1].lower() in self.extensions
+
+	def _report(self, name, key, closed=False):
+		if key is None:
+			if self.entries.pop(name, None) is None:
+				return
+		else:
+			self.entries[name] = key
+		self.onChange(self.directory / name, key, closed)
+
+	def _refresh(self, name, closed=False):
+		try:
+			stat = os.stat(self.directory / name)
+			key = (stat.st_size, stat.st_mtime_ns)
+		except FileNotFoundError:
+			key = None
+
+		if key != self.entries.get(name) or (closed and key is not None):
+			self._report(name, key, closed)
+
+	def _scan(self):
+		current = {}
+		with os.scandir(self.directory) as entries:
+			for entry in entries:
+				if self._matches(entry.name) and entry.is_file():
+					stat = entry.stat()
+					current[entry.name] = (stat.st_size, stat.st_mtime_ns)
+
+		for name in [name for name in self.entries if name not in current]:
+			self._report(name, None)
+		for name, key in current.items():
+			if self.entries.get(name) != key:
+				self._report(name, key)
+
+	def _arm(self):
+		try:
+			inotify = Inotify(self.directory, self.watchMask)
+			self.mode = 'inotify'
+			return inotify
+		except (OSError, AttributeError):
+			self.mode = 'poll'
+			return None
+
+	def _watch(self):
+		inotify = self._arm()
+		lost = False
+
+		try:
+			# one full scan to start from; after that only what changed is looked at
+			self._safeScan()
+			dirty = set()
+			flushedAt = time.monotonic()
+			while self._running:
+				if inotify is None:
+					self._wake.wait(self.interval)
+					self._wake.clear()
+					if self._running and self._safeScan() and lost:
+						# the folder is readable again, so the watch can be put back
+						inotify = self._arm()
+						if inotify is not None:
+							lost = False
+							# anything that changed before the watch was in place
+							self._safeScan()
+				else:
+					for mask, name in inotify.read(self.interval):
+						if mask & Inotify.IN_Q_OVERFLOW:
+							self._safeScan()
+						elif mask & (Inotify.IN_IGNORED | Inotify.IN_DELETE_SELF | Inotify.IN_MOVE_SELF):
+							# the folder itself went away; polling copes until it's back
+							inotify.close()
+							inotify = None
+							lost = True
+							self.mode = 'poll'
+							break
+						elif not self._matches(name):
+							continue
+						elif mask & Inotify.IN_MODIFY:
+							# a capture being recorded is written many times a second, so growth is batched
+							dirty.add(name)
+						else:
+							dirty.discard(name)
+							self._refresh(name, closed=bool(mask & Inotify.IN_CLOSE_WRITE))
+
+					if time.monotonic() - flushedAt >= self.interval:
+						for name in dirty:
+							self._refresh(name)
+						dirty.clear()
+						flushedAt = time.monotonic()
+
+				if self.onIdle is not None:
+					self.onIdle()
+		finally:
+			if inotify is not None:
+				inotify.close()
+
+	def _safeScan(self):
+		try:
+			self._scan()
+			return True
+		except FileNotFoundError:
+			for name in list(self.entries):
+				self._report(name, None)
+		except OSError:
+			pass
+		return False
+
+def copyChunked(source, destination, chunkSize=64 * 1024 * 1024):
+	size = os.stat(source).st_size
+	with open(source, 'rb') as sourceFile, open(destination, 'wb') as destinationFile:
+		copied = 0
+		inFD, outFD = sourceFile.fileno(), destinationFile.fileno()
+
+		# let the kernel move the bytes where it can, falling back to a plain buffered copy
+		for kernelCopy in [getattr(os, 'copy_file_range', None), getattr(os, 'sendfile', None)]:
+			if kernelCopy is None:
+				continue
+			try:
+				while copied < size:
+					if kernelCopy is os.sendfile:
+						sent = os.sendfile(outFD, inFD, copied, min(chunkSize, size - copied))
+					else:
+						sent = os.copy_file_range(inFD, outFD, min(chunkSize, size - copied), copied, copied)
+					if sent == 0:
+						break
+					copied += sent
+				break
+			except OSError:
+				copied = 0
+				destinationFile.seek(0)
+				destinationFile.truncate()
+
+		if copied < size:
+			sourceFile.seek(copied)
+			destinationFile.seek(copied)
+			while True:
+				chunk = sourceFile.read(chunkSize)
+				if not chunk:
+					break
+				destinationFile.write(chunk)
+				copied += len(chunk)
+
+		destinationFile.flush()
+		os.fsync(outFD)
+
+	return copied
+
+def appendFile(source, destination, chunkSize=8 * 1024 * 1024):
+	with open(source, 'rb') as sourceFile, open(destination, 'ab') as destinationFile:
+		while True:
+			chunk = sourceFile.read(chunkSize)
+			if not chunk:
+				break
+			destinationFile.write(chunk)
+		destinationFile.flush()
+		os.fsync(destinationFile.fileno())
+
+def truncateFile(path, size):
+	# drop anything appended after the last saved state, e.g. from a crash mid-append
+	path = pathlib.Path(path)
+	if path.exists() and path.stat().st_size > size:
+		with path.open('r+b') as openFile:
+			openFile.truncate(size)
+
+def writeJSON(path, data, indent=None, sync=True):
+	# readers only ever see the old or the new file, never half of one
+	path = pathlib.Path(path)
+	path.parent.mkdir(parents=True, exist_ok=True)
+	tempPath = path.with_suffix('.tmp')
+	with tempPath.open('w') as jsonFile:
+		json.dump(data, jsonFile, indent=indent)
+		if sync:
+			jsonFile.flush()
+			os.fsync(jsonFile.fileno())
+	os.replace(tempPath, path)
+
+def moveFile(source, destination):
+	source, destination = pathlib.Path(source), pathlib.Path(destination)
+	if destination.exists():
+		raise FileExistsError('%s already exists' % destination)
+
+	if isSameDevice(source, destination.parent):
+		source.rename(destination)
+		return 0
+
+	# across devices: copy next to the destination, check it, and only then delete the original
+	partial = destination.with_name(destination.name + '.part')
+	try:
+		copied = copyChunked(source, partial)
+		if copied != source.stat().st_size or partial.stat().st_size != copied:
+			raise OSError('Copy of %s is incomplete (%d of %d bytes)' % (source.name, partial.stat().st_size, source.stat().st_size))
+		partial.rename(destination)
+	except:
+		if partial.exists():
+			partial.unlink()
+		raise
+
+	source.unlink()
+	return copied
+
+class TrashCan():
+	folderName = '.trash'
+
+	def __init__(self, retention=3600, maxBytes=20 * 1024**3, interval=30):
+		self.retention = retention
+		self.maxBytes = maxBytes
+		self.interval = interval
+
+		self.entries = []
+		self.scannedFolders = set()
+		self._lock = threading.Lock()
+		self._wake = threading.Event()
+		self._reaper = None
+		self._running = False
+
+	def configure(self, retention=None, maxBytes=None):
+		if retention is not None:
+			self.retention = retention
+		if maxBytes is not None:
+			self.maxBytes = maxBytes
+		self._wake.set()
+
+	def adopt(self, directory):
+		# pick up anything left in the trash by an earlier session
+		folder = pathlib.Path(directory) / self.folderName
+		if folder in self.scannedFolders or not folder.is_dir():
+			return
+
+		self.scannedFolders.add(folder)
+		with self._lock:
+			known = set(entry['path'] for entry in self.entries)
+			for trashed in folder.iterdir():
+				if trashed in known or not trashed.is_file():
+					continue
+
+				stat = trashed.stat()
+				originalName = trashed.name.split('-', 1)[-1]
+				self.entries.append({
+					'path': trashed,
+					'original': pathlib.Path(directory) / originalName,
+					'time': stat.st_mtime,
+					'size': stat.st_size,
+				})
+			self.entries.sort(key=lambda entry: entry['time'])
+
+	def discard(self, path):
+		path = pathlib.Path(path)
+		folder = path.parent / self.folderName
+		folder.mkdir(exist_ok=True)
+
+		# a rename within the same folder tree stays on the same volume, so it's instant
+		stamp = datetime.now().strftime('%Y%m%d%H%M%S%f')
+		trashed = folder / f'{stamp}-{path.name}'
+		size = path.stat().st_size
+		path.rename(trashed)
+
+		with self._lock:
+			self.entries.append({
+				'path': trashed,
+				'original': path,
+				'time': time.time(),
+				'size': size,
+			})
+
+		self._wake.set()
+		return trashed
+
+	def restoreLast(self):
+		with self._lock:
+			while len(self.entries) > 0:
+				entry = self.entries.pop()
+				if not entry['path'].exists():
+					continue
+
+				original = entry['original']
+				if original.exists():
+					original = original.with_name(entry['path'].name)
+				entry['path'].rename(original)
+				return original
+
+		return None
+
+	def totalBytes(self):
+		with self._lock:
+			return sum(entry['size'] for entry in self.entries)
+
+	def reap(self):
+		now = time.time()
+		with self._lock:
+			total = sum(entry['size'] for entry in self.entries)
+			expired = []
+			for entry in self.entries:
+				if now - entry['time'] > self.retention or total > self.maxBytes:
+					expired.append(entry)
+					total -= entry['size']
+
+			for entry in expired:
+				self.entries.remove(entry)
+
+		# deleting is the slow part, so it happens outside the lock
+		failed = []
+		for entry in expired:
+			try:
+				entry['path'].unlink()
+			except FileNotFoundError:
+				pass
+			except OSError:
+				failed.append(entry)
+
+		if len(failed) > 0:
+			with self._lock:
+				self.entries = failed + self.entries
+
+		return len(expired) - len(failed)
+
+	def start(self):
+		if self._reaper is not None and self._reaper.is_alive():
+			return
+
+		self._running = True
+		self._reaper = threading.Thread(target=self._reapForever, name='TrashReaper', daemon=True)
+		self._reaper.start()
+
+	def stop(self):
+		self._running = False
+		self._wake.set()
+
+	def _reapForever(self):
+		while self._running:
+			self.reap()
+			self._wake.wait(self.interval)
+			self._wake.clear()
+
+class SessionJournal():
+	def __init__(self):
+		self.directory = None
+		self.path = None
+		self.records = []
+		self._file = None
+
+	def open(self, directory):
+		directory = pathlib.Path(directory)
+		if directory == self.directory:
+			return
+
+		self.close()
+		self.directory = directory
+		self.path = None
+		self.records = []
+
+		# carry on with the newest journal if it still has captures waiting to be combined
+		folder = stateFolder(directory) / 'journal'
+		journals = sorted(folder.glob('session-*.jsonl')) if folder.is_dir() else []
+		if len(journals) > 0:
+			self.records = self.replay(journals[-1])
+			if self._isFinished():
+				self.records = []
+			else:
+				self.path = journals[-1]
+				self._repairTail()
+
+	def close(self):
+		if self._file is not None:
+			self._file.close()
+			self._file = None
+
+	@staticmethod
+	def replay(path):
+		records = []
+		with open(path, encoding='utf-8') as journalFile:
+			for line in journalFile:
+				try:
+					records.append(json.loads(line))
+				except ValueError:
+					# a torn final line from a crash mid-write
+					break
+		return records
+
+	def append(self, event, **fields):
+		if self.directory is None:
+			return None
+
+		if self._file is None:
+			if self.path is None:
+				folder = stateFolder(self.directory) / 'journal'
+				folder.mkdir(parents=True, exist_ok=True)
+				self.path = folder / ('session-%s.jsonl' % datetime.now().strftime('%Y-%m-%d_%H-%M-%S-%f'))
+			self._file = open(self.path, 'a', encoding='utf-8')
+
+		record = {'event': event, 'time': time.time()}
+		record.update(fields)
+
+		self._file.write(json.dumps(record) + '\n')
+		self._file.flush()
+		os.fsync(self._file.fileno())
+		self.records.append(record)
+
+		if event == 'combined' and len(self.keptCaptures()) == 0:
+			# everything has been combined; the next event starts a new session
+			self.close()
+			self.path = None
+			self.records = []
+
+		return record
+
+	def keptCaptures(self, existingOnly=True):
+		kept = []
+		for record in self.records:
+			event = record['event']
+			if event == 'file' and record.get('kept'):
+				kept.append(record['path'])
+			elif event == 'restored':
+				kept.append(record['path'])
+			elif event == 'discarded' and record['path'] in kept:
+				kept.remove(record['path'])
+			elif event == 'combined':
+				kept = [path for path in kept if path not in record.get('inputs', [])]
+
+		paths = [pathlib.Path(path) for path in kept]
+		if existingOnly:
+			paths = [path for path in paths if path.exists()]
+
+		return paths
+
+	def interruptedRecording(self):
+		# a recording that started but never produced a file means OBS went down mid-take
+		recording = False
+		for record in self.records:
+			if record['event'] == 'recording-started':
+				recording = True
+			elif record['event'] in ('file', 'recording-failed'):
+				recording = False
+		return recording
+
+	def _repairTail(self):
+		# cut a torn final record so new records start on a clean line
+		with open(self.path, 'r+b') as journalFile:
+			data = journalFile.read()
+			if len(data) > 0 and not data.endswith(b'\n'):
+				journalFile.truncate(data.rfind(b'\n') + 1)
+
+	def _isFinished(self):
+		if len(self.records) == 0:
+			return True
+		return self.records[-1]['event'] == 'combined' and len(self.keptCaptures()) == 0
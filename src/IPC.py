@@ -0,0 +1,166 @@
+import math
+import json
+import time
+import struct
+import multiprocessing
+
+from enum import Enum, auto
+
+class MessageType(Enum):
+	UI_EVENT = auto()
+	OBS_EVENT = auto()
+	OBS_SETTINGS = auto()
+	LOG = auto()
+	DEBUG = auto()
+	EXCEPTION = auto()
+	JOB_STATUS = auto()
+	STATS = auto()
+	STARTUP = auto()
+	STATE = auto()
+	PROFILE = auto()
+	CATALOG = auto()
+	THUMBNAILS = auto()
+
+class Message():
+	def __init__(self, messageType, data, timestamp=None, sequence=None):
+		self.type = messageType
+		self.data = data
+		self.timestamp = time.time() if timestamp is None else timestamp
+		self.sequence = sequence
+
+	def __str__(self):
+		return '[%s] %s' % (self.type, self.data)
+
+# version, message type, payload kind, sequence number, timestamp
+protocolVersion = 1
+frameHeader = struct.Struct('<BBBxId')
+
+class PayloadKind(Enum):
+	NONE = 0
+	INT = 1
+	FLOAT = 2
+	TEXT = 3
+	JSON = 4
+
+def encodePayload(data):
+	if data is None:
+		return PayloadKind.NONE, b''
+	elif isinstance(data, bool):
+		return PayloadKind.JSON, b'true' if data else b'false'
+	elif isinstance(data, int):
+		return PayloadKind.INT, struct.pack('<q', data)
+	elif isinstance(data, float):
+		return PayloadKind.FLOAT, struct.pack('<d', data)
+	elif isinstance(data, str):
+		return PayloadKind.TEXT, data.encode('utf-8')
+
+	# paths and anything else without a JSON type go over as text
+	return PayloadKind.JSON, json.dumps(data, separators=(',', ':'), default=str).encode('utf-8')
+
+def decodePayload(kind, payload):
+	if kind == PayloadKind.NONE:
+		return None
+	elif kind == PayloadKind.INT:
+		return struct.unpack('<q', payload)[0]
+	elif kind == PayloadKind.FLOAT:
+		return struct.unpack('<d', payload)[0]
+	elif kind == PayloadKind.TEXT:
+		return payload.decode('utf-8')
+	return json.loads(payload.decode('utf-8'))
+
+def encodeFrame(message):
+	kind, payload = encodePayload(message.data)
+	return frameHeader.pack(protocolVersion, message.type.value, kind.value, message.sequence or 0, message.timestamp) + payload
+
+def decodeFrame(frame):
+	version, messageType, kind, sequence, timestamp = frameHeader.unpack_from(frame)
+	if version != protocolVersion:
+		raise ValueError('Unsupported message protocol version %d (expected %d)' % (version, protocolVersion))
+
+	data = decodePayload(PayloadKind(kind), bytes(frame[frameHeader.size:]))
+	return Message(MessageType(messageType), data, timestamp, sequence)
+
+class FramedPipe():
+	# wraps one end of a multiprocessing Pipe; same poll/recv/fileno surface as the Connection
+	def __init__(self, connection):
+		self.connection = connection
+		self.sequence = 0
+		self.lastReceived = None
+		self.framesSent = 0
+		self.bytesSent = 0
+		self.gaps = 0
+
+	def send(self, message):
+		self.sequence = (self.sequence + 1) & 0xffffffff
+		message.sequence = self.sequence
+		frame = encodeFrame(message)
+		self.connection.send_bytes(frame)
+		self.framesSent += 1
+		self.bytesSent += len(frame)
+
+	def recv(self):
+		message = decodeFrame(self.connection.recv_bytes())
+		if self.lastReceived is not None and message.sequence != (self.lastReceived + 1) & 0xffffffff:
+			self.gaps += 1
+		self.lastReceived = message.sequence
+		return message
+
+	def poll(self, timeout=0.0):
+		return self.connection.poll(timeout)
+
+	def fileno(self):
+		return self.connection.fileno()
+
+	def close(self):
+		self.connection.close()
+
+class SharedState():
+	# a seqlock over a block of doubles: one process writes, the other reads the latest values;
+	# slot 0 is the sequence (odd while a write is in progress), slot 1 the generation written
+	# under it and slot 2 the generation of the last poke the reader picked up
+	readAttempts = 10000
+
+	def __init__(self, fields, array=None):
+		self.fields = list(fields)
+		self.slots = {name: index + 3 for index, name in enumerate(self.fields)}
+		if array is None:
+			# nothing has been published yet, which reads back as None
+			array = multiprocessing.RawArray('d', [0, 0, 0] + [math.nan] * len(self.fields))
+		self.array = array
+		self.lastValues = {name: None for name in self.fields}
+		self.poked = 0
+
+	def write(self, **values):
+		array = self.array
+		array[0] += 1
+		array[1] += 1
+		for name, value in values.items():
+			array[self.slots[name]] = math.nan if value is None else value
+		array[0] += 1
+
+		# while the reader hasn't picked up the last poke, the read that poke causes is still to come
+		# and will see this write; otherwise it needs a new one. Each slot has a single writer, so
+		# unlike a shared flag this can't lose a wakeup
+		if array[2] < self.poked:
+			return None
+		self.poked = array[1]
+		return self.poked
+
+	def read(self, poke=None):
+		array = self.array
+		if poke is not None:
+			# picked up before reading, so a write that lands after this gets a poke of its own
+			array[2] = poke
+		for _ in range(self.readAttempts):
+			sequence = array[0]
+			if sequence % 2 == 1:
+				continue
+			values = {name: array[slot] for name, slot in self.slots.items()}
+			if array[0] == sequence:
+				break
+		else:
+			# the writer died mid-write; what was read last is all there is
+			return dict(self.lastValues)
+
+		self.lastValues = {name: None if math.isnan(value) else value for name, value in values.items()}
+		return dict(self.lastValues)
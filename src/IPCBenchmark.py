@@ -0,0 +1,177 @@
+import sys
+import time
+import pickle
+import random
+import pathlib
+from multiprocessing import Process, Pipe
+
+import IPC
+from IPC import MessageType, Message
+
+# OBSScriptLib needs obspython; outside OBS the headless stand-in provides it
+sys.path.append(str(pathlib.Path(__file__).resolve().parent / 'headless'))
+import OBSScriptLib
+
+# representative traffic between the script and the GUI
+samples = {
+	'recording event': (MessageType.OBS_EVENT, 2),
+	'ui event': (MessageType.UI_EVENT, 'checkpoint'),
+	'job progress': (MessageType.JOB_STATUS, {'id': 3, 'kind': 'combine', 'state': 'RUNNING', 'time': 1700000000.0, 'progress': {
+		'bytes': 123456789, 'expected_bytes': 987654321, 'out_time': 1234.5, 'speed': '41.2x', 'rate': 45678901.2,
+		'elapsed': 30.2, 'eta': 211.7, 'percent': 12.5, 'finished': False}}),
+	'settings': (MessageType.OBS_SETTINGS, {
+		'debug': False, 'font': {'face': 'Merriweather', 'style': 'normal', 'size': 36, 'flags': 0},
+		'recording_text': '\\n⏺️\\n\\nRecording', 'recording_bg_color': '#f00007', 'recording_fg_color': '#fffff0',
+		'paused_text': '\\n⏸\\n\\nPaused', 'paused_bg_color': '#ffff00', 'paused_fg_color': '#000000',
+		'stopped_text': '\\n⏹️\\n\\nStopped', 'stopped_bg_color': '#000000', 'stopped_fg_color': '#ffffff',
+		'video_path': pathlib.Path('~/Videos').expanduser(), 'resume_delay': .5, 'hotkey_reset': 'r'}),
+}
+
+stateFields = ['recording_event', 'job_id', 'percent', 'bytes', 'rate', 'speed', 'out_time', 'eta']
+
+def echoPickled(connection):
+	while True:
+		message = connection.recv()
+		if message is None:
+			break
+		connection.send(message)
+
+def echoFramed(connection):
+	pipe = IPC.FramedPipe(connection)
+	while True:
+		message = pipe.recv()
+		if message.data == 'stop':
+			break
+		pipe.send(message)
+
+def echoShared(connection, array):
+	# read the block on every poke and answer with the sequence it saw
+	pipe = IPC.FramedPipe(connection)
+	state = IPC.SharedState(stateFields, array)
+	while True:
+		message = pipe.recv()
+		if message.data == 'stop':
+			break
+		values = state.read()
+		pipe.send(Message(MessageType.STATE, values['job_id']))
+
+class AgeGUI(OBSScriptLib.ScriptGUI):
+	# the real GUI pump in either wakeup mode, noting how old each sample is when it's handled
+	def __init__(self, *args):
+		self.ages = []
+		super().__init__(*args)
+
+	def onMessageReceived(self, message):
+		if message.type == MessageType.UI_EVENT and message.data == 'sample':
+			self.ages.append(time.time() - message.timestamp)
+		elif message.type == MessageType.UI_EVENT and message.data == 'report':
+			self.send(MessageType.STATS, self.ages)
+		elif message.type == MessageType.UI_EVENT and message.data == 'stop':
+			self.root.quit()
+		else:
+			super().onMessageReceived(message)
+
+def pumpAges(wakeupMode, count, spacing=.01):
+	parent, child = Pipe()
+	process = Process(target=OBSScriptLib._bootstrapGUIApp, args=(AgeGUI, child, wakeupMode, True), daemon=True)
+	process.start()
+	# only the GUI holds the other end, so a GUI that dies shows up as EOF instead of a full pipe
+	child.close()
+	pipe = IPC.FramedPipe(parent)
+	try:
+		# spaced out like real traffic, so each sample waits on a wakeup rather than riding along with the last
+		for _ in range(count):
+			if not process.is_alive():
+				break
+			pipe.send(Message(MessageType.UI_EVENT, 'sample'))
+			time.sleep(random.uniform(0, spacing * 2))
+		if process.is_alive():
+			pipe.send(Message(MessageType.UI_EVENT, 'report'))
+
+		while pipe.poll(10):
+			message = pipe.recv()
+			if message.type == MessageType.STATS:
+				ages = sorted(message.data)
+				return ages[len(ages) // 2], ages[int(len(ages) * .95)]
+			elif message.type == MessageType.EXCEPTION:
+				raise RuntimeError(message.data.splitlines()[0])
+		raise RuntimeError('the GUI did not report')
+	finally:
+		if process.is_alive():
+			pipe.send(Message(MessageType.UI_EVENT, 'stop'))
+			process.join(2)
+			process.terminate()
+
+def pumpBenchmark(count=300):
+	results = []
+	for wakeupMode in ['poll', 'event']:
+		try:
+			results.append((wakeupMode, pumpAges(wakeupMode, count)))
+		except (RuntimeError, EOFError, OSError) as exc:
+			# Tk needs a display
+			results.append((wakeupMode, str(exc)))
+	return results
+
+def roundTrips(send, recv, count):
+	times = []
+	for _ in range(count):
+		start = time.perf_counter()
+		send()
+		recv()
+		times.append(time.perf_counter() - start)
+	times.sort()
+	return times[len(times) // 2], times[int(len(times) * .95)]
+
+def benchmark(count=2000):
+	results = []
+
+	parent, child = Pipe()
+	process = Process(target=echoPickled, args=(child,))
+	process.start()
+	for name, (messageType, data) in samples.items():
+		size = len(pickle.dumps(Message(messageType, data), protocol=pickle.HIGHEST_PROTOCOL))
+		p50, p95 = roundTrips(lambda: parent.send(Message(messageType, data)), parent.recv, count)
+		results.append(('pickled Message', name, size, p50, p95))
+	parent.send(None)
+	process.join()
+
+	parent, child = Pipe()
+	process = Process(target=echoFramed, args=(child,))
+	process.start()
+	pipe = IPC.FramedPipe(parent)
+	for name, (messageType, data) in samples.items():
+		size = len(IPC.encodeFrame(Message(messageType, data)))
+		p50, p95 = roundTrips(lambda: pipe.send(Message(messageType, data)), pipe.recv, count)
+		results.append(('framed', name, size, p50, p95))
+	pipe.send(Message(MessageType.UI_EVENT, 'stop'))
+	process.join()
+
+	state = IPC.SharedState(stateFields)
+	parent, child = Pipe()
+	process = Process(target=echoShared, args=(child, state.array))
+	process.start()
+	pipe = IPC.FramedPipe(parent)
+	def publish():
+		state.write(job_id=3, percent=12.5, bytes=123456789, rate=45678901.2, speed=41.2, out_time=1234.5, eta=211.7)
+		pipe.send(Message(MessageType.STATE, None))
+	size = len(IPC.encodeFrame(Message(MessageType.STATE, None)))
+	p50, p95 = roundTrips(publish, pipe.recv, count)
+	results.append(('shared state', 'job progress', size, p50, p95))
+	pipe.send(Message(MessageType.UI_EVENT, 'stop'))
+	process.join()
+
+	return results
+
+if __name__ == '__main__':
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+	print('%-16s %-16s %8s %10s %10s' % ('transport', 'message', 'bytes', 'p50 (us)', 'p95 (us)'))
+	for transport, name, size, p50, p95 in benchmark(count):
+		print('%-16s %-16s %8d %10.1f %10.1f' % (transport, name, size, p50 * 1e6, p95 * 1e6))
+
+	print()
+	print('%-16s %10s %10s' % ('gui wakeup', 'p50 (ms)', 'p95 (ms)'))
+	for wakeupMode, ages in pumpBenchmark():
+		if isinstance(ages, str):
+			print('%-16s %s' % (wakeupMode, ages))
+		else:
+			print('%-16s %10.2f %10.2f' % (wakeupMode, ages[0] * 1000, ages[1] * 1000))
@@ -1,18 +1,33 @@
-import sys
+import multiprocessing
 import obspython as obs
 import OBSScriptLib
-import os, pathlib
+import VideoCombiner
+import FileTools
+import pathlib
+import math
+import bisect
 import tkinter
 from tkinter import ttk, messagebox
-import subprocess
 from datetime import datetime
 
 from enum import Enum, auto
-from system_hotkey import SystemHotkey
 
 #from NetworkClient import NetworkClient
 
+# published through shared memory rather than sent as messages
+sharedStateFields = ['recording_event', 'job_id', 'percent', 'bytes', 'rate', 'speed', 'out_time', 'eta']
+
+def parseSpeed(speed):
+	try:
+		return float(speed.split('x')[0])
+	except (AttributeError, ValueError):
+		return None
+
 class KROZ_ControlDeck(OBSScriptLib.OBSScriptWithGUI):
+	stopSignalTimeout = 5
+	startTimeout = 10
+	sharedStateFields = sharedStateFields
+
 	def __init__(self):
 		desc = '''            ██╗      ██╗  ██████╗        ██████╗     ███████╗
             ██║   ██╔╝  ██╔══██╗  ██╔═══██╗  ╚══███╔╝              😻
@@ -23,10 +38,42 @@ class KROZ_ControlDeck(OBSScriptLib.OBSScriptWithGUI):
 		super().__init__(desc, KROZ_GUI)
 
 		self.saveCompleteAction = None
-		self.restartRecordingTimer = 0
+		self.recorderState = RecorderState.IDLE
+		self.commands = OBSScriptLib.CommandQueue()
+		self.commandHandlers = {
+			'toggle': self.doRecordingToggle,
+			'reset': self.doRecordingReset,
+			'checkpoint': self.doRecordingCheckpoint,
+			'combine': self.doCombine,
+			'cancel-combine': lambda command: self.combineJobs.cancel(),
+			'undo-reset': lambda command: self.undoReset(),
+			'dump-stats': lambda command: self.dumpStats(),
+			'export-profile-json': lambda command: self.exportProfile('json'),
+			'export-profile-csv': lambda command: self.exportProfile('csv'),
+			'recording-finished': self.profiler.timed('onRecordingFinished', lambda command: self.onRecordingFinished(command.args['code'], command.timestamp)),
+			'frontend-event': lambda command: self.handleFrontendEvent(command.args['event'], command.timestamp),
+		}
+		self.scheduler = OBSScriptLib.Scheduler()
+		self.transitions = OBSScriptLib.TransitionStats()
+		self.recordingClock = OBSScriptLib.RecordingClock()
+		self.markers = VideoCombiner.MarkerLog()
+		self.combineJobs = VideoCombiner.CombineJobQueue()
+		self.captures = OBSScriptLib.CaptureIndex()
+		self.trash = FileTools.TrashCan()
+		self.journal = FileTools.SessionJournal()
+		self.catalog = None
+		self.thumbnails = None
+		self.thumbnailItems = {}
+		# captures with an append job queued or running, by job id, and those whose append failed
+		self.appendJobs = {}
+		self.failedAppends = set()
 #		self.pptClient = None
 
 		self.hotkeys = {}
+		self.hotkeyKeys = {}
+
+		# only the script binds hotkeys, so the GUI process never pays for this import
+		from system_hotkey import SystemHotkey
 		self.systemHotkey = SystemHotkey()
 
 	def setupProperties(self):
@@ -52,6 +99,22 @@ class KROZ_ControlDeck(OBSScriptLib.OBSScriptWithGUI):
 		self.addProperty('ffmpeg_path', 'Path to FFMPEG binary', pathlib.Path('C:\\Program Files\\ffmpeg-4.2.2-win64-static\\bin'))
 		self.addProperty('video_path', 'Path to video location', pathlib.Path('~/Videos').expanduser())
 		self.addProperty('resume_delay', 'Delay (s) before resuming record', .5)
+		self.addProperty('combine_workers', 'Sessions to combine at once', 2)
+		self.addProperty('session_gap', 'Gap (minutes) that starts a new session when combining loose videos', 30.)
+		self.addProperty('alternate_output_path', 'Write combined videos here when the video drive is too full (optional)', '')
+		self.addProperty('reencode_combine', 'Re-encode when combining (smaller file, uses every CPU core)', False)
+		self.addProperty('encode_crf', 'Re-encode quality (x264 CRF, lower is better)', 23)
+		self.addProperty('encode_preset', 'Re-encode preset (x264)', 'veryfast')
+		self.addProperty('encode_chunk', 'Re-encode chunk length (minutes)', 5.)
+		self.addProperty('incremental_combine', 'Append each checkpoint to a rolling combine as it finishes', False)
+		self.addProperty('marker_mode', 'Checkpoint/reset with markers instead of restarting the recording', False)
+		self.addProperty('trash_retention', 'Keep reset takes for (minutes)', 60.)
+		self.addProperty('trash_max_gb', 'Maximum size of reset takes kept (GB)', 20.)
+		self.addProperty('watch_video_folder', 'Keep a live count of loose footage in the video folder', True)
+		self.addProperty('low_space_warning_gb', 'Warn when free space on the video drive drops below (GB)', 10.)
+		self.addProperty('thumbnail_count', 'Thumbnails of recent checkpoints to show (0 = none)', 4)
+
+		self.addProperty('command_debounce', 'Ignore repeats of the same command within (s)', .5)
 
 		self.addProperty('hotkey_toggle_record', 'Recording toggle hotkey | ctrl+shift+', 'space')
 		self.addProperty('hotkey_reset', 'Recording reset hotkey | ctrl+shift+', 'r')
@@ -78,10 +141,37 @@ class KROZ_ControlDeck(OBSScriptLib.OBSScriptWithGUI):
 #			self.log('PPT connected')
 
 	def onFrontendEvent(self, event):
-		self.send(OBSScriptLib.MessageType.OBS_EVENT, event)
+		# OBS calls this on its UI thread; the recorder, scheduler, journal and pipe all belong to the tick
+		self.commands.push('frontend-event', 'obs', event=event)
+
+	def handleFrontendEvent(self, event, receivedAt=None):
+		self.recordingClock.onFrontendEvent(event, receivedAt)
+		if event in recordingStateEvents:
+			self.publishState(recording_event=event)
+		else:
+			self.send(OBSScriptLib.MessageType.OBS_EVENT, event)
+
+		if event in (obs.OBS_FRONTEND_EVENT_RECORDING_STARTED, obs.OBS_FRONTEND_EVENT_RECORDING_UNPAUSED):
+			self.setRecorderState(RecorderState.RECORDING)
+		elif event == obs.OBS_FRONTEND_EVENT_RECORDING_PAUSED:
+			self.setRecorderState(RecorderState.PAUSED)
+		elif event == obs.OBS_FRONTEND_EVENT_RECORDING_STOPPED and self.recordingClock.isRunning():
+			# the stop signal hasn't been handled yet; stay busy until it is, but don't wait on it forever
+			self.setRecorderState(RecorderState.STOPPING)
+			self.scheduler.schedule(self.stopSignalTimeout, self.onStopSignalTimeout, 'stop-signal-timeout')
+
+		if event == obs.OBS_FRONTEND_EVENT_RECORDING_STARTED:
+			self.recordEvent('recording-started')
+
+		if event == obs.OBS_FRONTEND_EVENT_RECORDING_STARTED and self.transitions.current is not None:
+			self.transitions.mark('restarted', receivedAt)
+			transition = self.transitions.finish()
+			self.debug('%s took %.3fs' % (transition['kind'], transition['phases'].get('total', 0)))
+			self.send(OBSScriptLib.MessageType.STATS, {'transitions': self.transitions.summary(), 'commands': self.commands.summary()})
 
 	def onLoad(self):
 		super().onLoad()
+		self.trash.start()
 
 		if self.settings['open_immediately']:
 			self.toggleWindow()
@@ -89,36 +179,120 @@ class KROZ_ControlDeck(OBSScriptLib.OBSScriptWithGUI):
 		print(f'{self.name} Loaded!')
 
 	def onUpdate(self):
-		self.unbindHotkeys()
+		changed = self.changedSettings
+		self.captures.directory = self.settings['video_path']
 
-		self.hotkeys = {}
-		keySettings = {
-			'hotkey_checkpoint': self.doRecordingCheckpoint,
-			'hotkey_toggle_record': self.doRecordingToggle,
-			'hotkey_reset': self.doRecordingReset,
-		}
+		if not changed.isdisjoint(['trash_retention', 'trash_max_gb']):
+			self.trash.configure(self.settings['trash_retention'] * 60, self.settings['trash_max_gb'] * 1024**3)
+
+		if 'video_path' in changed:
+			try:
+				self.trash.adopt(self.settings['video_path'])
+			except OSError:
+				self.log('Could not read the trash in %s' % self.settings['video_path'])
+
+			try:
+				self.journal.open(self.settings['video_path'])
+				if self.journal.interruptedRecording():
+					self.log('The session journal ends mid-recording; OBS may have closed before the last take was saved')
+			except OSError:
+				self.log('Could not open the session journal in %s' % self.settings['video_path'])
+
+			interrupted = VideoCombiner.CombineJob.interruptedStates(self.settings['video_path'])
+			if len(interrupted) > 0:
+				self.log('%d interrupted combine(s) will resume the next time you combine' % len(interrupted))
+
+		if not changed.isdisjoint(['video_path', 'ffmpeg_path', 'watch_video_folder']):
+			self.restartCatalog()
+		if 'low_space_warning_gb' in changed and self.catalog is not None:
+			self.catalog.lowSpaceBytes = self.settings['low_space_warning_gb'] * 1024**3
+
+		if not changed.isdisjoint(['video_path', 'ffmpeg_path']):
+			if self.thumbnails is not None:
+				self.thumbnails.shutdown()
+			self.thumbnails = VideoCombiner.ThumbnailCache(self.settings['ffmpeg_path'], self.settings['video_path'])
+			self.thumbnailItems = {}
+		if not changed.isdisjoint(['video_path', 'ffmpeg_path', 'thumbnail_count']):
+			self.requestThumbnails()
+			self.sendThumbnails()
+
+		if 'command_debounce' in changed:
+			debounce = self.settings['command_debounce']
+			self.commands.debounce = {name: debounce for name in recorderCommands}
+
+		# only the hotkeys whose setting changed are unbound and bound again
+		for setting, command in hotkeySettings.items():
+			if setting not in changed:
+				continue
+
+			oldKey = self.hotkeyKeys.pop(setting, None)
+			if oldKey is not None:
+				self.unbindHotkey(oldKey)
 
-		for setting,action in keySettings.items():
 			k = self.settings[setting]
 			if k not in ('', None):
-				self.hotkeys[('control', 'shift', k)] = action
-
-		self.bindHotkeys()
+				key = ('control', 'shift', k)
+				# hotkeys fire on the hotkey library's thread, so they only queue the command
+				self.hotkeys[key] = self.profiler.timed('hotkey', lambda event, command=command: self.commands.push(command, 'hotkey'))
+				self.hotkeyKeys[setting] = key
+				self.bindHotkey(key)
+
+		super().onUpdate()
+
+	def restartCatalog(self):
+		if self.catalog is not None:
+			self.catalog.stop()
+			self.catalog = None
+
+		if self.settings['watch_video_folder']:
+			self.catalog = VideoCombiner.LooseFootageCatalog(self.settings['video_path'], self.settings['ffmpeg_path'], self.settings['low_space_warning_gb'] * 1024**3)
+			self.catalog.start()
+		# the GUI starts its list over from whatever the new catalog finds
+		self.send(OBSScriptLib.MessageType.CATALOG, {'reset': True, 'changes': [], 'totals': None, 'warning': None})
+
+	def recentCaptures(self):
+		count = self.settings['thumbnail_count']
+		if count <= 0:
+			return []
+		# archived captures leave the journal's kept list, and deleted ones have nothing to show
+		return [str(capture) for capture in self.journal.keptCaptures()[-count:]]
+
+	def requestThumbnails(self):
+		# extraction happens on the cache's workers; results come back through onTick
+		for capture in self.recentCaptures():
+			if capture not in self.thumbnailItems:
+				self.thumbnails.request(capture)
+
+	def sendThumbnails(self):
+		items = [self.thumbnailItems[capture] for capture in self.recentCaptures() if capture in self.thumbnailItems]
+		self.send(OBSScriptLib.MessageType.THUMBNAILS, [item for item in items if 'error' not in item])
+
+	def unbindHotkey(self, key):
+		self.hotkeys.pop(key, None)
+		cbs = list(self.systemHotkey.get_callback(key))
+		if len(cbs) > 0 and cbs[0] is not None:
+			self.debug('unbinding hotkey', key)
+			self.systemHotkey.unregister(key)
 
 	def unbindHotkeys(self):
-		for key in self.hotkeys.keys():
-			cbs = list(self.systemHotkey.get_callback(key))
-			if len(cbs) > 0 and cbs[0] is not None:
-				self.debug('unbinding hotkey', key)
-				self.systemHotkey.unregister(key)
+		for key in list(self.hotkeys.keys()):
+			self.unbindHotkey(key)
+		self.hotkeyKeys = {}
 
-	def bindHotkeys(self):
-		for key,func in self.hotkeys.items():
-			self.debug('binding hotkey', key, 'to', func)
-			self.systemHotkey.register(key, callback=func, overwrite=True)
+	def bindHotkey(self, key):
+		self.debug('binding hotkey', key, 'to', self.hotkeys[key])
+		self.systemHotkey.register(key, callback=self.hotkeys[key], overwrite=True)
 
 	def onUnload(self):
 		self.unbindHotkeys()
+		self.combineJobs.shutdown()
+		self.trash.stop()
+		if self.catalog is not None:
+			self.catalog.stop()
+		if self.thumbnails is not None:
+			self.thumbnails.shutdown()
+		self.journal.close()
+		self.scheduler.cancelAll()
 		if self.isGUIProcessActive():
 			self.process.terminate()
 
@@ -127,98 +301,223 @@ class KROZ_ControlDeck(OBSScriptLib.OBSScriptWithGUI):
 		super().onGUIProcessStarted()
 
 		if obs.obs_frontend_recording_paused():
-			self.send(OBSScriptLib.MessageType.OBS_EVENT, obs.OBS_FRONTEND_EVENT_RECORDING_PAUSED)
+			self.publishState(recording_event=obs.OBS_FRONTEND_EVENT_RECORDING_PAUSED)
 		elif obs.obs_frontend_recording_active():
-			self.send(OBSScriptLib.MessageType.OBS_EVENT, obs.OBS_FRONTEND_EVENT_RECORDING_STARTED)
+			self.publishState(recording_event=obs.OBS_FRONTEND_EVENT_RECORDING_STARTED)
 		else:
-			self.send(OBSScriptLib.MessageType.OBS_EVENT, obs.OBS_FRONTEND_EVENT_RECORDING_STOPPED)
+			self.publishState(recording_event=obs.OBS_FRONTEND_EVENT_RECORDING_STOPPED)
+
+		if self.catalog is not None:
+			self.send(OBSScriptLib.MessageType.CATALOG, self.catalog.snapshot())
+		self.sendThumbnails()
+
+	def setRecorderState(self, state):
+		if state != self.recorderState:
+			self.debug('Recorder %s -> %s' % (self.recorderState.name, state.name))
+			self.recorderState = state
+		if state != RecorderState.STOPPING:
+			self.scheduler.cancel('stop-signal-timeout')
+		if state not in (RecorderState.STARTING, RecorderState.RESTARTING):
+			self.scheduler.cancel('start-timeout')
+
+	def isCommandAllowed(self, command):
+		if command.name in recorderCommands and self.recorderState not in (RecorderState.IDLE, RecorderState.RECORDING, RecorderState.PAUSED):
+			self.log('Ignoring %s while %s' % (command, self.recorderState.name.lower()))
+			return False
+		return True
 
-	def doRecordingToggle(self, _=None):
+	def recordEvent(self, event, **fields):
+		# the journal lives on the recording drive, and a full drive mustn't stop the recorder
+		try:
+			self.journal.append(event, **fields)
+		except OSError as exc:
+			self.log('Could not write %s to the session journal: %s' % (event, exc))
+
+	def executeCommand(self, command):
+		self.commandHandlers[command.name](command)
+
+	def onCommandFailed(self, command, error):
+		self.log('%s failed:\n%s' % (command, error))
+
+	def onStopSignalTimeout(self):
+		if self.recorderState == RecorderState.STOPPING:
+			self.log('No stop signal from the recording output; accepting commands again')
+			self.saveCompleteAction = None
+			self.setRecorderState(RecorderState.IDLE)
+
+	def startRecording(self, restarting=False):
+		# a start that fails (bad output path, full disk, encoder error) never reports RECORDING_STARTED
+		self.setRecorderState(RecorderState.RESTARTING if restarting else RecorderState.STARTING)
+		self.scheduler.schedule(self.startTimeout, self.onStartTimeout, 'start-timeout')
+		obs.obs_frontend_recording_start()
+
+	def onStartTimeout(self):
+		if self.recorderState in (RecorderState.STARTING, RecorderState.RESTARTING) and not obs.obs_frontend_recording_active():
+			self.log('The recording did not start within %ds; check the output path, free space and encoder settings' % self.startTimeout)
+			self.transitions.abandon()
+			self.setRecorderState(RecorderState.IDLE)
+
+	def doRecordingToggle(self, command=None):
 		if obs.obs_frontend_recording_paused():
 			obs.obs_frontend_recording_pause(False)
 		elif obs.obs_frontend_recording_active():
 			if self.settings['pause_instead_of_stop']:
 				obs.obs_frontend_recording_pause(True)
 			else:
+				self.setRecorderState(RecorderState.STOPPING)
 				obs.obs_frontend_recording_stop()
 		else:
-			obs.obs_frontend_recording_start()
-
-	def doRecordingReset(self, _=None):
-		if obs.obs_frontend_recording_paused() or obs.obs_frontend_recording_active():
+			self.startRecording()
+
+	def doRecordingReset(self, command=None):
+		if self.settings['marker_mode'] and self.recordingClock.isRunning():
+			self.addMarker('reset')
+		elif obs.obs_frontend_recording_paused() or obs.obs_frontend_recording_active():
+			self.transitions.begin('reset', None if command is None else command.source, None if command is None else command.timestamp)
+			self.recordEvent('reset')
 			self.log('Resetting to last checkpoint')
 			self.saveCompleteAction = self.deleteOnSaveCompleteAndResume
+			self.transitions.mark('stop_requested')
+			self.setRecorderState(RecorderState.STOPPING)
 			obs.obs_frontend_recording_stop()
 		else:
 			self.log('Starting recording')
-			obs.obs_frontend_recording_start()
-
-	def doRecordingCheckpoint(self, _=None):
-		if obs.obs_frontend_recording_paused() or obs.obs_frontend_recording_active():
+			self.startRecording()
+
+	def doRecordingCheckpoint(self, command=None):
+		if self.settings['marker_mode'] and self.recordingClock.isRunning():
+			self.addMarker('checkpoint')
+		elif obs.obs_frontend_recording_paused() or obs.obs_frontend_recording_active():
+			self.transitions.begin('checkpoint', None if command is None else command.source, None if command is None else command.timestamp)
+			self.recordEvent('checkpoint')
 			self.log('Checkpoint!')
 			self.saveCompleteAction = self.resume
+			self.transitions.mark('stop_requested')
+			self.setRecorderState(RecorderState.STOPPING)
 			obs.obs_frontend_recording_stop()
 		else:
 			self.log('Starting recording')
-			obs.obs_frontend_recording_start()
+			self.startRecording()
+
+	def doCombine(self, command=None):
+		if obs.obs_frontend_recording_paused() or  obs.obs_frontend_recording_active():
+			# wait for the last capture to be written before combining it
+			self.saveCompleteAction = self.combineVideos
+			self.setRecorderState(RecorderState.STOPPING)
+			obs.obs_frontend_recording_stop()
+		else:
+			self.combineVideos()
+
+	def addMarker(self, kind):
+		offset = self.recordingClock.elapsed()
+		self.markers.add(kind, offset)
+		self.recordEvent(kind, marker=offset)
+		self.log('%s marker at %s' % (kind.capitalize(), VideoCombiner.formatDuration(offset)))
 
 	def onMessageReceived(self, msg):
 		super().onMessageReceived(msg)
 
 		if msg.type == OBSScriptLib.MessageType.UI_EVENT:
-			if msg.data == 'click':
-				self.doRecordingToggle()
-			elif msg.data == 'reset':
-				self.doRecordingReset()
-			elif msg.data == 'checkpoint':
-				self.doRecordingCheckpoint()
-			elif msg.data == 'combine':
-				if obs.obs_frontend_recording_paused() or  obs.obs_frontend_recording_active():
-					obs.obs_frontend_recording_stop()
-
-				self.combineVideos()
+			command = 'toggle' if msg.data == 'click' else msg.data
+			if command in self.commandHandlers:
+				self.commands.push(command, 'gui')
 
 	def combineVideos(self):
-		now = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-
-		path = pathlib.Path(self.settings['video_path'])
-		chapters = sorted(path.glob('*.mkv'))
-
-		processedFolder = path / 'processed'
-		processedFolder.mkdir(parents=True, exist_ok=True)
-
-		outputFilePath = path / f'combined/{now}-combined.mkv'
-		outputFilePath.parent.mkdir(parents=True, exist_ok=True)
-
-		chapterFilePath = path / f'chapters-{now}.txt'
-		with chapterFilePath.open('w') as chapterFile:
-			for c in chapters:
-				chapterFile.write('file \'%s\'\n' % str(c))
-
-		ffmpegPath = self.settings['ffmpeg_path'] / 'ffmpeg'
-		ffmpegCommand = f'"{ffmpegPath}" -f concat -safe 0 -i "{chapterFilePath}" -c copy "{outputFilePath}"'
-		self.log(ffmpegCommand)
-
-		stdoutPath = outputFilePath.parent / (outputFilePath.stem + '-output.txt')
-		stdoutPath.write_text(str(chapterFilePath) + '\r\n' + chapterFilePath.read_text() + '\r\n********\r\n' + ffmpegCommand + '\r\n')
-		ffmpegResult = subprocess.run(ffmpegCommand, check=True, universal_newlines=True, stdout=stdoutPath.open('a'), stderr=subprocess.STDOUT)
-		chapterFilePath.unlink()
-
-		self.send(OBSScriptLib.MessageType.OBS_EVENT, 'combine-complete')
+		self.saveCompleteAction = None
 
-		for chapterVideo in chapters:
-			try:
-				chapterVideo.rename(processedFolder / chapterVideo.name)
-			except:
-				self.log('Failed to move ' + chapterVideo.name)
+		# the journal knows which takes were kept and in what order
+		captures = self.journal.keptCaptures()
+
+		if self.settings['incremental_combine']:
+			if len(captures) == 0:
+				self.log('No journaled captures to combine, falling back to a folder scan')
+				captures = FileTools.findLooseCaptures(self.settings['video_path'])
+
+			# anything not yet appended goes in first; the queue runs jobs in order
+			queued = set(self.appendJobs.values())
+			for capture in captures:
+				if str(capture) in queued:
+					continue
+				if str(capture) in self.failedAppends:
+					# appending it now would put it after newer takes
+					self.log('%s failed to append earlier and stays in the video folder' % capture.name)
+					continue
+				self.appendToRollingCombine(capture)
+			job = VideoCombiner.FinalizeRollingJob(self.settings['video_path'], self.settings['ffmpeg_path'])
+		else:
+			# other loose videos are split into sessions and combined alongside the journaled one
+			job = VideoCombiner.SessionCombineJob(
+				self.settings['video_path'],
+				self.settings['ffmpeg_path'],
+				sessions=[captures],
+				maxWorkers=self.settings['combine_workers'],
+				sessionGap=self.settings['session_gap'] * 60,
+				encoder=self.getEncoder(),
+				alternateOutputPath=self.settings['alternate_output_path'].strip() or None,
+			)
+
+		self.log('Queued %s job %d' % (job.kind, job.id))
+		self.combineJobs.submit(job)
+
+	def getEncoder(self):
+		if not self.settings['reencode_combine']:
+			return None
+
+		encoder = dict(VideoCombiner.defaultEncoder)
+		encoder['crf'] = self.settings['encode_crf']
+		encoder['preset'] = self.settings['encode_preset']
+		encoder['chunk'] = max(30, self.settings['encode_chunk'] * 60)
+		return encoder
+
+	def appendToRollingCombine(self, capturePath):
+		job = VideoCombiner.AppendSegmentJob(self.settings['video_path'], self.settings['ffmpeg_path'], capturePath)
+		self.debug('Queued append job %d for %s' % (job.id, capturePath))
+		self.appendJobs[job.id] = str(capturePath)
+		self.combineJobs.submit(job)
 
 	def onTick(self, seconds):
 		super().onTick(seconds)
-		if self.restartRecordingTimer > 0:
-			self.restartRecordingTimer -= seconds
-			if self.restartRecordingTimer <= 0:
-				self.debug('RESUMING')
-				obs.obs_frontend_recording_start()
+
+		# everything that drives the recorder runs here, one command at a time
+		self.commands.drain(self.executeCommand, self.isCommandAllowed, self.onCommandFailed)
+
+		for status in self.combineJobs.getStatusUpdates():
+			if 'message' in status:
+				self.log('[Combine %d] %s' % (status['id'], status['message']))
+			if status['state'] == 'COMPLETE' and status['kind'] in ('combine', 'finalize'):
+				self.recordEvent('combined', inputs=status['inputs'], output=status['output'])
+			if status['id'] in self.appendJobs and status['state'] in ('COMPLETE', 'FAILED', 'CANCELLED'):
+				capture = self.appendJobs.pop(status['id'])
+				if status['state'] != 'COMPLETE':
+					self.failedAppends.add(capture)
+				self.sendThumbnails()
+
+			if 'progress' in status:
+				progress = status['progress']
+				self.publishState(job_id=status['id'], percent=progress['percent'], bytes=progress['bytes'], rate=progress['rate'],
+					speed=parseSpeed(progress['speed']), out_time=progress['out_time'], eta=progress['eta'])
+			else:
+				self.send(OBSScriptLib.MessageType.JOB_STATUS, status)
+
+		# the watcher has already done the work; this just forwards what changed
+		if self.catalog is not None:
+			update = self.catalog.getUpdates()
+			if update is not None:
+				if update.get('warning'):
+					self.log(update['warning'])
+				self.send(OBSScriptLib.MessageType.CATALOG, update)
+
+		if self.thumbnails is not None:
+			results = self.thumbnails.getResults()
+			for result in results:
+				if 'error' in result:
+					# kept so it isn't retried on every checkpoint
+					self.debug('No thumbnails for %s: %s' % (result['name'], result['error']))
+				self.thumbnailItems[result['capture']] = result
+			if len(results) > 0:
+				self.sendThumbnails()
+
+		self.scheduler.runDue()
 
 #		if self.pptClient is not None:
 #			try:
@@ -237,28 +536,112 @@ class KROZ_ControlDeck(OBSScriptLib.OBSScriptWithGUI):
 #			self.saveCompleteAction = self.resume
 #			obs.obs_frontend_recording_stop()
 #
-	def onRecordingFinished(self, data):
-		stopCode = obs.calldata_int(data, 'code')
-		if stopCode == 0:
-			if self.saveCompleteAction is not None:
-				self.saveCompleteAction()
+	def onRecordingFinished(self, stopCode, signalledAt=None):
+		self.setRecorderState(RecorderState.IDLE)
+		if stopCode != 0:
+			self.recordEvent('recording-failed', code=stopCode)
+			self.transitions.abandon()
+			self.recordingClock.stop()
+			self.markers.clear()
+			self.saveCompleteAction = None
+		else:
+			try:
+				self.transitions.mark('stop_signal', signalledAt)
+				capturePath = self.getLastRecordingPath()
+				duration = self.recordingClock.stop()
+				if capturePath is not None:
+					self.captures.record(capturePath)
+					markerCount = len(self.markers.markers)
+					if markerCount > 0:
+						try:
+							self.markers.save(capturePath, duration)
+						except OSError as exc:
+							self.log('Could not save the markers for %s: %s' % (capturePath.name, exc))
+							self.markers.clear()
+
+					kept = self.saveCompleteAction != self.deleteOnSaveCompleteAndResume
+					self.recordEvent('file', path=str(capturePath), kept=kept, duration=duration, markers=markerCount)
+					if kept:
+						self.requestThumbnails()
+
+					# kept takes are checkpoints and plain stops; resets get discarded and combine appends its own
+					if self.settings['incremental_combine'] and self.saveCompleteAction in (None, self.resume):
+						self.appendToRollingCombine(capturePath)
+			finally:
+				# whatever went wrong with the bookkeeping, a checkpoint still has to resume recording
+				if self.saveCompleteAction is not None:
+					self.saveCompleteAction()
 
 		return True
 
+	def getLastRecordingPath(self):
+		if hasattr(obs, 'obs_frontend_get_last_recording'):
+			path = obs.obs_frontend_get_last_recording()
+			if path:
+				return pathlib.Path(path)
+
+		# older frontends: ask the recording output where it wrote to
+		output = obs.obs_frontend_get_recording_output()
+		outputSettings = obs.obs_output_get_settings(output)
+		path = obs.obs_data_get_string(outputSettings, 'path')
+		obs.obs_data_release(outputSettings)
+		obs.obs_output_release(output)
+
+		if path:
+			return pathlib.Path(path)
+		return None
+
 	def deleteOnSaveCompleteAndResume(self):
-		latest = OBSScriptLib.findLatestCapture(self.settings['video_path'])
+		latest = self.captures.latest()
 		self.debug('DELETING %s' % str(latest))
-		
-		latest.unlink()
-		self.resume()
+
+		try:
+			trashed = self.trash.discard(latest)
+			self.captures.forget(latest)
+			self.recordEvent('discarded', path=str(latest), trash=str(trashed))
+		except Exception as exc:
+			self.log('Failed to discard %s: %s' % (latest, exc))
+		finally:
+			self.resume()
+
+	def undoReset(self):
+		restored = self.trash.restoreLast()
+		if restored is None:
+			self.log('Nothing to undo')
+		else:
+			self.log('Restored %s' % restored.name)
+			self.captures.record(restored)
+			self.recordEvent('restored', path=str(restored))
+			self.requestThumbnails()
 
 	def resume(self):
 		self.saveCompleteAction = None
-		self.restartRecordingTimer = self.settings['resume_delay']
+		self.setRecorderState(RecorderState.RESTARTING)
+		self.transitions.mark('finalized')
+		self.scheduler.schedule(self.settings['resume_delay'], self.restartRecording, 'restart')
+
+	def restartRecording(self):
+		self.debug('RESUMING')
+		self.startRecording(restarting=True)
+
+	def dumpStats(self):
+		now = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+		statsPath = pathlib.Path(self.settings['video_path']) / f'kroz-stats-{now}.json'
+		self.transitions.dump(statsPath, commands=self.commands.summary(), startup=self.startupTimes)
+		self.log('Saved stats to %s' % statsPath)
+
+	def exportProfile(self, extension):
+		now = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+		profilePath = pathlib.Path(self.settings['video_path']) / f'kroz-profile-{now}.{extension}'
+		OBSScriptLib.exportProfile(profilePath, self.profileSnapshots())
+		self.log('Saved callback timings to %s' % profilePath)
 
 class KROZ_GUI(OBSScriptLib.ScriptGUI):
+	sharedStateFields = sharedStateFields
+
 	def initGUI(self, root):
 		self.state = None
+		self.lastProgress = None
 
 		root.geometry('360x360')
 		root.title('KROZ Control Deck')
@@ -272,7 +655,11 @@ class KROZ_GUI(OBSScriptLib.ScriptGUI):
 		self.fileToolsTab = ttk.Frame(self.tabWidget)
 
 		self.tabWidget.add(self.recordingControlsTab, text='Controller')
+		self.statsTab = ttk.Frame(self.tabWidget)
 		self.tabWidget.add(self.fileToolsTab, text='File tools')
+		self.tabWidget.add(self.statsTab, text='Stats')
+		self.diagnosticsTab = ttk.Frame(self.tabWidget)
+		self.tabWidget.add(self.diagnosticsTab, text='Diagnostics')
 		self.tabWidget.pack(expand=1, fill=tkinter.BOTH)
 
 		self.labelText = tkinter.StringVar()
@@ -294,42 +681,254 @@ class KROZ_GUI(OBSScriptLib.ScriptGUI):
 		self.combineButton.config(font=('Impact', 18))
 		self.combineButton.pack(expand=True, fill=tkinter.BOTH)
 
+		self.combineStatusText = tkinter.StringVar()
+		self.combineStatusLabel = tkinter.Label(self.fileToolsTab, textvariable=self.combineStatusText)
+		self.combineStatusLabel.pack(fill=tkinter.X)
+
+		self.combineProgress = ttk.Progressbar(self.fileToolsTab, orient=tkinter.HORIZONTAL, mode='determinate', maximum=100)
+		self.combineProgress.pack(fill=tkinter.X)
+
+		self.combineProgressText = tkinter.StringVar()
+		self.combineProgressLabel = tkinter.Label(self.fileToolsTab, textvariable=self.combineProgressText)
+		self.combineProgressLabel.pack(fill=tkinter.X)
+
+		self.cancelCombineButton = tkinter.Button(self.fileToolsTab, text='Cancel combine', command=self.cancelCombine, state=tkinter.DISABLED)
+		self.cancelCombineButton.pack(fill=tkinter.X)
+
+		self.undoResetButton = tkinter.Button(self.fileToolsTab, text='↶ Undo last reset', command=self.undoReset)
+		self.undoResetButton.pack(fill=tkinter.X)
+
+		self.footageText = tkinter.StringVar()
+		self.footageLabel = tkinter.Label(self.fileToolsTab, textvariable=self.footageText)
+		self.footageLabel.pack(fill=tkinter.X)
+
+		self.spaceWarningText = tkinter.StringVar()
+		self.spaceWarningLabel = tkinter.Label(self.fileToolsTab, textvariable=self.spaceWarningText, fg='red', wraplength=340)
+		self.spaceWarningLabel.pack(fill=tkinter.X)
+
+		self.footageNames = []
+		self.footageList = tkinter.Listbox(self.fileToolsTab, height=5, font=('Courier', 9))
+		self.footageList.pack(fill=tkinter.X)
+
+		self.thumbnailItems = []
+		self.thumbnailImages = {}
+		self.thumbnailsShown = None
+		self.thumbnailFrame = tkinter.Frame(self.fileToolsTab)
+		self.thumbnailFrame.pack(fill=tkinter.X)
+		self.tabWidget.bind('<<NotebookTabChanged>>', lambda event: self.showThumbnails())
+
+		self.statsText = tkinter.StringVar()
+		self.statsText.set('No checkpoints or resets yet')
+		self.statsLabel = tkinter.Label(self.statsTab, textvariable=self.statsText, justify=tkinter.LEFT, anchor=tkinter.NW, font=('Courier', 9))
+		self.statsLabel.pack(expand=True, fill=tkinter.BOTH)
+
+		self.dumpStatsButton = tkinter.Button(self.statsTab, text='Save stats (JSON)', command=self.dumpStats)
+		self.dumpStatsButton.pack(fill=tkinter.X)
+
+		self.profileText = tkinter.StringVar()
+		self.profileText.set('Set "Time one in N calls" in the script properties to profile callbacks')
+		self.profileLabel = tkinter.Label(self.diagnosticsTab, textvariable=self.profileText, justify=tkinter.LEFT, anchor=tkinter.NW, font=('Courier', 9))
+		self.profileLabel.pack(expand=True, fill=tkinter.BOTH)
+
+		self.exportProfileJSONButton = tkinter.Button(self.diagnosticsTab, text='Export timings (JSON)', command=lambda: self.exportProfile('json'))
+		self.exportProfileJSONButton.pack(fill=tkinter.X, side=tkinter.LEFT, expand=True)
+		self.exportProfileCSVButton = tkinter.Button(self.diagnosticsTab, text='Export timings (CSV)', command=lambda: self.exportProfile('csv'))
+		self.exportProfileCSVButton.pack(fill=tkinter.X, side=tkinter.RIGHT, expand=True)
 
 	def setState(self, state):
+		if state == self.state:
+			return
+
 		self.debug('Received state %s' % state)
 		self.state = state
-		self.refreshDisplay()
-		
-	def refreshDisplay(self):
-		f = self.settings['font']
-		self.label.config(font=(f['face'], f['size']))
-
-		if self.state == States.RECORDING:
-			self.label.config(bg=self.settings['recording_bg_color'], fg=self.settings['recording_fg_color'])
-			self.labelText.set(decode(self.settings['recording_text']))
-		elif self.state == States.STOPPED:
-			self.label.config(bg=self.settings['stopped_bg_color'], fg=self.settings['stopped_fg_color'])
-			self.labelText.set(decode(self.settings['stopped_text']))
-		elif self.state == States.PAUSED:
-			self.label.config(bg=self.settings['paused_bg_color'], fg=self.settings['paused_fg_color'])
-			self.labelText.set(decode(self.settings['paused_text']))
+		prefix = statePrefixes[state]
+		self.refreshDisplay(set([prefix + '_bg_color', prefix + '_fg_color', prefix + '_text']))
+
+	def refreshDisplay(self, changed=None):
+		# only reconfigure the widgets the changed settings touch; None means all of them
+		if changed is None or 'font' in changed:
+			f = self.settings['font']
+			self.label.config(font=(f['face'], f['size']))
+
+		prefix = statePrefixes.get(self.state)
+		if prefix is None:
+			return
+
+		if changed is None or not changed.isdisjoint([prefix + '_bg_color', prefix + '_fg_color']):
+			self.label.config(bg=self.settings[prefix + '_bg_color'], fg=self.settings[prefix + '_fg_color'])
+		if changed is None or prefix + '_text' in changed:
+			self.labelText.set(decode(self.settings[prefix + '_text']))
 
 	def onMessageReceived(self, msg):
 		super().onMessageReceived(msg)
 
 		if msg.type == OBSScriptLib.MessageType.OBS_EVENT:
-			if msg.data in [obs.OBS_FRONTEND_EVENT_RECORDING_STARTED, obs.OBS_FRONTEND_EVENT_RECORDING_UNPAUSED]:
-				self.setState(States.RECORDING)
-			elif msg.data == obs.OBS_FRONTEND_EVENT_RECORDING_STOPPED:
-				self.setState(States.STOPPED)
-			elif msg.data == obs.OBS_FRONTEND_EVENT_RECORDING_PAUSED:
-				self.setState(States.PAUSED)
-			elif msg.data == obs.OBS_FRONTEND_EVENT_EXIT:
-				self.root.quit()
-			elif msg.data == 'combine-complete':
-				messagebox.showinfo('Render complete', 'All of your loose videos have been combined into a single render and organized!')
+			self.onOBSEvent(msg.data)
 		elif msg.type == OBSScriptLib.MessageType.OBS_SETTINGS:
-			self.refreshDisplay()
+			self.refreshDisplay(set(msg.data.keys()))
+		elif msg.type == OBSScriptLib.MessageType.JOB_STATUS:
+			self.onCombineStatus(msg.data)
+		elif msg.type == OBSScriptLib.MessageType.STATS:
+			self.showStats(msg.data)
+		elif msg.type == OBSScriptLib.MessageType.CATALOG:
+			self.onCatalog(msg.data)
+		elif msg.type == OBSScriptLib.MessageType.THUMBNAILS:
+			self.thumbnailItems = msg.data
+			self.showThumbnails()
+
+	def onSharedState(self, values):
+		if values['recording_event'] is not None:
+			self.onOBSEvent(int(values['recording_event']))
+		# the block holds the latest of everything, so only act on progress that actually moved
+		progress = tuple(values[name] for name in sharedStateFields[1:])
+		if values['job_id'] is not None and progress != self.lastProgress:
+			self.lastProgress = progress
+			self.onCombineProgress(values)
+
+	def onOBSEvent(self, event):
+		if event in [obs.OBS_FRONTEND_EVENT_RECORDING_STARTED, obs.OBS_FRONTEND_EVENT_RECORDING_UNPAUSED]:
+			self.setState(States.RECORDING)
+		elif event == obs.OBS_FRONTEND_EVENT_RECORDING_STOPPED:
+			self.setState(States.STOPPED)
+		elif event == obs.OBS_FRONTEND_EVENT_RECORDING_PAUSED:
+			self.setState(States.PAUSED)
+		elif event == obs.OBS_FRONTEND_EVENT_EXIT:
+			self.root.quit()
+
+	def showStats(self, stats):
+		lines = ['%-10s %8s %8s' % ('phase (ms)', 'p50', 'p95')]
+		for kind, phases in stats['transitions'].items():
+			lines.append('')
+			lines.append('%s x%d' % (kind, phases['count']))
+			for phase in OBSScriptLib.TransitionStats.phases:
+				if phase in phases:
+					lines.append('  %-8s %8.1f %8.1f' % (phase, phases[phase]['p50'] * 1000, phases[phase]['p95'] * 1000))
+
+		commands = stats['commands']
+		lines.append('')
+		lines.append('commands  %d run, %d debounced, %d rejected, %d failed' % (commands['executed'], commands['debounced'], commands['rejected'], commands['failed']))
+		if 'latency' in commands:
+			lines.append('  %-8s %8.1f %8.1f' % ('queued', commands['latency']['p50'] * 1000, commands['latency']['p95'] * 1000))
+
+		self.statsText.set('\n'.join(lines))
+
+	def onProfile(self, scriptProfile, guiProfile):
+		# one row of bars per callback, over the same buckets for all of them
+		edges = OBSScriptLib.CallbackProfiler.bucketEdges
+		lines = ['%-19s %7s %6s %6s %6s' % ('callback (ms)', 'calls', 'p50', 'p95', 'max')]
+		for name, timings in sorted(list(scriptProfile.items()) + list(guiProfile.items())):
+			if timings['sampled'] == 0:
+				lines.append('%-19s %7d' % (name, timings['calls']))
+				continue
+
+			lines.append('%-19s %7d %6.2f %6.2f %6.2f' % (name, timings['calls'], timings['p50'] * 1000, timings['p95'] * 1000, timings['max'] * 1000))
+			peak = max(timings['histogram'])
+			lines.append('  ' + ''.join(histogramBars[math.ceil(count * (len(histogramBars) - 1) / peak)] for count in timings['histogram']))
+
+		lines.append('')
+		lines.append('buckets up to %s ms, then slower' % ' '.join('%.3g' % (edge * 1000) for edge in edges))
+		self.profileText.set('\n'.join(lines))
+
+	def onCatalog(self, update):
+		if update.get('reset'):
+			self.footageNames = []
+			self.footageList.delete(0, tkinter.END)
+
+		# rows are patched in place; the list is never rebuilt from scratch
+		for change in update['changes']:
+			name = change['name']
+			index = bisect.bisect_left(self.footageNames, name)
+			present = index < len(self.footageNames) and self.footageNames[index] == name
+			if present:
+				self.footageNames.pop(index)
+				self.footageList.delete(index)
+			if change.get('removed'):
+				continue
+
+			duration = '--:--:--' if change['duration'] is None else VideoCombiner.formatDuration(change['duration'])
+			self.footageNames.insert(index, name)
+			self.footageList.insert(index, '%-24s %9s %8s' % (name[-24:], VideoCombiner.formatBytes(change['size']), duration))
+
+		totals = update['totals']
+		if totals is None:
+			self.footageText.set('')
+		else:
+			text = 'Loose footage: %d capture%s, %s, %s' % (totals['count'], '' if totals['count'] == 1 else 's', VideoCombiner.formatBytes(totals['bytes']), VideoCombiner.formatDuration(totals['duration']))
+			if totals['unprobed'] > 0:
+				text += ' (%d not measured yet)' % totals['unprobed']
+			if totals['free'] is not None:
+				text += '\n%s free' % VideoCombiner.formatBytes(totals['free'])
+			self.footageText.set(text)
+
+		if 'warning' in update:
+			self.spaceWarningText.set(update['warning'] or '')
+
+	def showThumbnails(self):
+		# images are only read once the tab is on screen, and only for the captures listed
+		if self.tabWidget.select() != str(self.fileToolsTab) or self.thumbnailsShown == self.thumbnailItems:
+			return
+		self.thumbnailsShown = self.thumbnailItems
+
+		for widget in self.thumbnailFrame.winfo_children():
+			widget.destroy()
+
+		images = {}
+		for index, item in enumerate(self.thumbnailItems):
+			cell = tkinter.Frame(self.thumbnailFrame)
+			cell.grid(row=index // 2, column=index % 2, padx=2, pady=2)
+			for column, which in enumerate(['first', 'last']):
+				path = item[which]
+				if path not in images:
+					try:
+						images[path] = self.thumbnailImages.get(path) or tkinter.PhotoImage(file=path)
+					except tkinter.TclError:
+						images[path] = None
+				tkinter.Label(cell, image=images[path], text='?' if images[path] is None else '').grid(row=0, column=column)
+			tkinter.Label(cell, text=item['name'][-19:], font=('Courier', 8)).grid(row=1, column=0, columnspan=2)
+
+		# Tk drops an image once nothing references it, so the ones still shown are kept and the rest let go
+		self.thumbnailImages = images
+
+	def onCombineStatus(self, status):
+		state = status['state']
+		if state == 'RUNNING' and 'message' not in status:
+			self.combineProgress.config(mode='determinate', value=0)
+			self.combineProgressText.set('')
+		if state in ('QUEUED', 'RUNNING'):
+			self.cancelCombineButton.config(state=tkinter.NORMAL)
+		else:
+			self.cancelCombineButton.config(state=tkinter.DISABLED)
+
+		text = '%s %d: %s' % (status['kind'].capitalize(), status['id'], state.lower())
+		if 'message' in status and state != 'RUNNING':
+			text += '\n' + status['message']
+		self.combineStatusText.set(text)
+
+		if status['kind'] == 'append':
+			return
+
+		if state == 'COMPLETE':
+			messagebox.showinfo('Render complete', 'All of your loose videos have been combined into a single render and organized!')
+		elif state == 'FAILED':
+			messagebox.showerror('Render failed', status.get('message', 'The combine job failed'))
+
+	def onCombineProgress(self, progress):
+		if progress['percent'] is None:
+			if self.combineProgress.cget('mode') != 'indeterminate':
+				self.combineProgress.config(mode='indeterminate')
+			self.combineProgress.step(5)
+		else:
+			self.combineProgress.config(mode='determinate', value=progress['percent'])
+
+		text = '%s written @ %s/s (%s)   %s' % (
+			VideoCombiner.formatBytes(progress['bytes']),
+			VideoCombiner.formatBytes(progress['rate']),
+			'N/A' if progress['speed'] is None else '%.1fx' % progress['speed'],
+			VideoCombiner.formatDuration(progress['out_time']),
+		)
+		if progress['eta'] is not None:
+			text += '   ETA %s' % VideoCombiner.formatDuration(progress['eta'])
+		self.combineProgressText.set(text)
 
 	def onClick(self):
 		self.send(OBSScriptLib.MessageType.UI_EVENT, 'click')
@@ -343,19 +942,66 @@ class KROZ_GUI(OBSScriptLib.ScriptGUI):
 	def combine(self):
 		self.send(OBSScriptLib.MessageType.UI_EVENT, 'combine')
 
+	def cancelCombine(self):
+		self.send(OBSScriptLib.MessageType.UI_EVENT, 'cancel-combine')
+
+	def undoReset(self):
+		self.send(OBSScriptLib.MessageType.UI_EVENT, 'undo-reset')
+
+	def dumpStats(self):
+		self.send(OBSScriptLib.MessageType.UI_EVENT, 'dump-stats')
+
+	def exportProfile(self, extension):
+		self.send(OBSScriptLib.MessageType.UI_EVENT, 'export-profile-' + extension)
+
+class RecorderState(Enum):
+	IDLE = auto()
+	STARTING = auto()
+	RECORDING = auto()
+	PAUSED = auto()
+	STOPPING = auto()
+	RESTARTING = auto()
+
+hotkeySettings = {
+	'hotkey_checkpoint': 'checkpoint',
+	'hotkey_toggle_record': 'toggle',
+	'hotkey_reset': 'reset',
+}
+
+# commands that drive the recorder, and so are only valid outside a transition
+recorderCommands = ['toggle', 'reset', 'checkpoint', 'combine']
+
 class States(Enum):
 	PAUSED = auto()
 	RECORDING = auto()
 	STOPPED = auto()
 
+statePrefixes = {
+	States.RECORDING: 'recording',
+	States.PAUSED: 'paused',
+	States.STOPPED: 'stopped',
+}
+
 def decode(text):
 	return text.replace('\\n', '\n').replace('\\t', '\t')
 
-if pathlib.Path(sys.executable).stem not in ['python', 'pythonw']:
+histogramBars = ' ▁▂▃▄▅▆▇█'
+
+recordingStateEvents = [
+	obs.OBS_FRONTEND_EVENT_RECORDING_STARTED,
+	obs.OBS_FRONTEND_EVENT_RECORDING_UNPAUSED,
+	obs.OBS_FRONTEND_EVENT_RECORDING_STOPPED,
+	obs.OBS_FRONTEND_EVENT_RECORDING_PAUSED,
+]
+
+# the GUI process imports this module too, but only the process OBS (or the headless simulation) loaded registers
+if multiprocessing.current_process().name == 'MainProcess':
 	scriptInstance = KROZ_ControlDeck()
 	scriptInstance.register()
 	recordingSignalHandler = obs.obs_output_get_signal_handler(obs.obs_frontend_get_recording_output())
-	def recordingFinished(*args):
-		return scriptInstance.onRecordingFinished(*args)
+	def recordingFinished(calldata):
+		# this runs on the output's thread; calldata is only valid here, so take the code and queue the rest
+		scriptInstance.commands.push('recording-finished', 'obs', code=obs.calldata_int(calldata, 'code'))
+		return True
 
 	obs.signal_handler_connect(recordingSignalHandler, 'stop', recordingFinished)
@@ -2,47 +2,96 @@ import multiprocessing
 from multiprocessing import Process, Queue, Pipe
 
 import sys, os
-import argparse
-import random
 import time
 import math
-import inspect
+import threading
+import json
+import csv
+import bisect
 import pathlib
+import functools
+import collections
+import traceback
 import tkinter
-import pkg_resources
-
-from enum import Enum, auto
 
 import obspython as obs
 
-multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'pythonw.exe'))
+from IPC import MessageType, Message, FramedPipe, SharedState
+
+# inside OBS on Windows the interpreter is obs64.exe, so child processes need pointing at a real python
+if os.name == 'nt' and pathlib.Path(sys.executable).stem.lower() not in ['python', 'pythonw']:
+	multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'pythonw.exe'))
+
+assetsFolder = pathlib.Path(__file__).resolve().parent / 'assets'
 
 def locateAsset(*resourceParts):
-	resource = '/'.join(['assets'] + list(resourceParts))
-	return pkg_resources.resource_filename(__name__, resource)
+	return str(assetsFolder.joinpath(*resourceParts))
 
-def findLatestCapture(directory, ignoreName=None):
-	def new_video_sort_key(f):
-		if f.name[-3:] in ['flv', 'mp4', 'mov', 'mkv'] and f.name is not ignoreName:
-			return f.stat().st_mtime
-		return 0
+videoExtensions = ['flv', 'mp4', 'mov', 'mkv']
 
-	newest_video_file = sorted(os.scandir(directory), key=new_video_sort_key, reverse=True)[0]
-	if new_video_sort_key(newest_video_file) is 0:
+def isVideoFile(name):
+	return name[-3:].lower() in videoExtensions
+
+def findLatestCapture(directory, ignoreName=None):
+	newest_video_file = None
+	newest_mtime = 0
+	with os.scandir(directory) as entries:
+		for entry in entries:
+			if not isVideoFile(entry.name) or entry.name == ignoreName or not entry.is_file():
+				continue
+
+			mtime = entry.stat().st_mtime
+			if mtime > newest_mtime:
+				newest_video_file, newest_mtime = entry, mtime
+
+	if newest_video_file is None:
 		print("Could not find any video files!")
 		return None
 
 	return pathlib.Path(directory) / newest_video_file.name
 
+class CaptureIndex():
+	def __init__(self, directory=None):
+		self.directory = directory
+		self.captures = []
+
+	def record(self, path):
+		path = pathlib.Path(path)
+		if path in self.captures:
+			self.captures.remove(path)
+		self.captures.append(path)
+
+	def forget(self, path):
+		path = pathlib.Path(path)
+		if path in self.captures:
+			self.captures.remove(path)
+
+	def latest(self, ignoreName=None):
+		# newest first; entries that have since vanished are dropped as we go
+		for path in reversed(list(self.captures)):
+			if path.name == ignoreName:
+				continue
+			if path.exists():
+				return path
+			self.captures.remove(path)
+
+		if self.directory is None:
+			return None
+
+		return findLatestCapture(self.directory, ignoreName)
+
 def getOBSFont(settings, name):
 	font = obs.obs_data_get_obj(settings, name)
 
-	return {
+	value = {
 		'face': obs.obs_data_get_string(font, 'face'),
 		'style': obs.obs_data_get_string(font, 'style'),
 		'size': obs.obs_data_get_int(font, 'size'),
 		'flags': obs.obs_data_get_int(font, 'flags'),
 	}
+	obs.obs_data_release(font)
+
+	return value
 
 def setOBSFont(settings, name, props):
 	font = obs.obs_data_create()
@@ -151,16 +200,22 @@ class OBSProp():
 		return self.funcs['get'](settings, self.name)
 
 class OBSScript():
+	# OBS calls these every frame or every keystroke, so they're what the profiler times
+	profiledCallbacks = ['script_tick', 'script_update']
+
 	def __init__(self, description='An OBS Script'):
 		self.name = self.__class__.__name__
 
 		self.description = description
 		self.props = []
 		self.settings = {}
+		self.changedSettings = set()
+		self.profiler = CallbackProfiler()
 		self.setupProperties()
 
 	def setupProperties(self):
 		self.addProperty('debug', 'Debug mode', False)
+		self.addProperty('profile_sample_every', 'Time one in N calls of each hot callback (0 = off, 1 = every call)', 0)
 		
 	def addProperty(self, name, description, defaultValue=None, dataType=None):
 		self.props.append(OBSProp(name, description, defaultValue, dataType))
@@ -189,9 +244,8 @@ class OBSScript():
 			prop._setDefault(settings)
 
 	def register(self):
-		stack = inspect.stack()
-		callingFrame = stack[1]
-		callingModule = inspect.getmodule(callingFrame[0])
+		# the caller's frame is enough; inspect.stack() would read the source of every frame
+		callingModule = sys.modules[sys._getframe(1).f_globals['__name__']]
 
 		functionNameMap = {
 			'script_description': 'getDescription',
@@ -205,6 +259,8 @@ class OBSScript():
 		for obsFuncName,objFuncName in functionNameMap.items():
 			if hasattr(self, objFuncName):
 				func = getattr(self, objFuncName)
+				if obsFuncName in self.profiledCallbacks:
+					func = self.profiler.timed(obsFuncName, func)
 				setattr(callingModule, obsFuncName, func)
 
 	def onUnload(self):
@@ -222,49 +278,433 @@ class OBSScript():
 
 		self._loadNewSettings(settings)
 		self.onLoad()
+		# every setting is new at load, so a script_update with the same values after this is a no-op
+		self.onUpdate()
 
 	def onLoad(self):
 		pass
 
 	def _onUpdate(self, settings):
-		self._loadNewSettings(settings)
-		self.onUpdate()
+		# OBS calls this for every keystroke in a text field, often with nothing actually different
+		if len(self._loadNewSettings(settings)) > 0:
+			self.onUpdate()
 
 	def onUpdate(self):
-		pass
+		if 'profile_sample_every' in self.changedSettings:
+			self.profiler.configure(self.settings['profile_sample_every'])
 
 	def _loadNewSettings(self, props):
-		self.settings = {}
+		settings = {}
 		for prop in self.props:
-			self.settings[prop.name] = prop.get(props)
+			settings[prop.name] = prop.get(props)
+
+		self.changedSettings = set(name for name, value in settings.items() if name not in self.settings or self.settings[name] != value)
+		self.settings = settings
+		return self.changedSettings
 
 
+class Command():
+	def __init__(self, name, source=None, args=None):
+		self.name = name
+		self.source = source
+		self.args = args or {}
+		self.timestamp = time.monotonic()
+
+	def __str__(self):
+		return '%s from %s' % (self.name, self.source)
+
+class CommandQueue():
+	# hotkeys, signals and the GUI can push from any thread; only the script tick drains
+	def __init__(self, debounce=None, history=500):
+		self.commands = collections.deque()
+		self.debounce = dict(debounce or {})
+		self.lastAccepted = {}
+		self.latencies = collections.deque(maxlen=history)
+		self.counts = {'executed': 0, 'debounced': 0, 'rejected': 0, 'failed': 0}
+
+	def push(self, name, source=None, **args):
+		# deque appends are atomic, so no lock is needed on the producer side
+		self.commands.append(Command(name, source, args))
+
+	def __len__(self):
+		return len(self.commands)
+
+	def drain(self, execute, isAllowed=None, onError=None):
+		results = []
+		while True:
+			try:
+				command = self.commands.popleft()
+			except IndexError:
+				break
+
+			lastAccepted = self.lastAccepted.get(command.name)
+			if lastAccepted is not None and command.timestamp - lastAccepted < self.debounce.get(command.name, 0):
+				self.counts['debounced'] += 1
+				results.append((command, 'debounced'))
+				continue
+
+			if isAllowed is not None and not isAllowed(command):
+				self.counts['rejected'] += 1
+				results.append((command, 'rejected'))
+				continue
+
+			self.lastAccepted[command.name] = command.timestamp
+			self.latencies.append(time.monotonic() - command.timestamp)
+			try:
+				execute(command)
+				self.counts['executed'] += 1
+				results.append((command, 'executed'))
+			except Exception:
+				# one failing command mustn't take the rest of the tick with it
+				self.counts['failed'] += 1
+				results.append((command, 'failed'))
+				if onError is not None:
+					onError(command, traceback.format_exc())
+
+		return results
+
+	def summary(self):
+		summary = dict(self.counts)
+		latencies = list(self.latencies)
+		if len(latencies) > 0:
+			summary['latency'] = {'p50': percentile(latencies, .5), 'p95': percentile(latencies, .95), 'max': max(latencies)}
+		return summary
+
+class Scheduler():
+	def __init__(self, useOBSTimers=True):
+		self.useOBSTimers = useOBSTimers
+		self.tasks = {}
+
+	def schedule(self, delay, callback, name=None):
+		if name is None:
+			name = callback
+		self.cancel(name)
+
+		task = {'deadline': time.monotonic() + delay, 'callback': callback, 'timer': None}
+		self.tasks[name] = task
+
+		if self.useOBSTimers:
+			# OBS timers fire between ticks, independent of how frame time accumulates
+			def fire():
+				obs.timer_remove(fire)
+				task['timer'] = None
+				self.runDue()
+
+			task['timer'] = fire
+			obs.timer_add(fire, max(1, math.ceil(delay * 1000)))
+
+	def cancel(self, name):
+		task = self.tasks.pop(name, None)
+		if task is not None and task['timer'] is not None:
+			obs.timer_remove(task['timer'])
+
+	def cancelAll(self):
+		for name in list(self.tasks.keys()):
+			self.cancel(name)
+
+	def isScheduled(self, name):
+		return name in self.tasks
+
+	def runDue(self):
+		now = time.monotonic()
+		due = [(name, task) for name, task in self.tasks.items() if task['deadline'] <= now]
+		for name, task in due:
+			if self.tasks.get(name) is task:
+				self.cancel(name)
+				task['callback']()
+
+		return len(due)
+
+class RecordingClock():
+	def __init__(self):
+		self.startedAt = None
+		self.pausedAt = None
+		self.pausedTotal = 0
+
+	def onFrontendEvent(self, event, at=None):
+		now = time.monotonic() if at is None else at
+		if event == obs.OBS_FRONTEND_EVENT_RECORDING_STARTED:
+			self.startedAt = now
+			self.pausedAt = None
+			self.pausedTotal = 0
+		elif event == obs.OBS_FRONTEND_EVENT_RECORDING_PAUSED:
+			self.pausedAt = now
+		elif event == obs.OBS_FRONTEND_EVENT_RECORDING_UNPAUSED and self.pausedAt is not None:
+			self.pausedTotal += now - self.pausedAt
+			self.pausedAt = None
+
+	def isRunning(self):
+		return self.startedAt is not None
+
+	def elapsed(self):
+		if self.startedAt is None:
+			return 0
+
+		# paused time never makes it into the file, so it doesn't count
+		now = time.monotonic()
+		paused = self.pausedTotal
+		if self.pausedAt is not None:
+			paused += now - self.pausedAt
+
+		return now - self.startedAt - paused
+
+	def stop(self):
+		elapsed = self.elapsed()
+		self.startedAt = None
+		self.pausedAt = None
+		return elapsed
+
+def percentile(values, fraction):
+	if len(values) == 0:
+		return None
+
+	ordered = sorted(values)
+	index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+	return ordered[index]
+
+class TransitionStats():
+	marks = ['pressed', 'stop_requested', 'stop_signal', 'finalized', 'restarted']
+	phases = {
+		'dispatch': ('pressed', 'stop_requested'),
+		'stop': ('stop_requested', 'stop_signal'),
+		'finalize': ('stop_signal', 'finalized'),
+		'restart': ('finalized', 'restarted'),
+		'gap': ('stop_signal', 'restarted'),
+		'total': ('pressed', 'restarted'),
+	}
+
+	def __init__(self, history=500):
+		self.history = history
+		self.current = None
+		self.completed = []
+
+	def begin(self, kind, source=None, pressedAt=None):
+		self.current = {'kind': kind, 'source': source, 'time': time.time(), 'marks': {'pressed': time.monotonic() if pressedAt is None else pressedAt}}
+
+	def mark(self, name, at=None):
+		if self.current is not None and name not in self.current['marks']:
+			self.current['marks'][name] = time.monotonic() if at is None else at
+
+	def abandon(self):
+		self.current = None
+
+	def finish(self):
+		transition = self.current
+		self.current = None
+		if transition is None:
+			return None
+
+		transition['phases'] = {}
+		marks = transition['marks']
+		for phase, (start, end) in self.phases.items():
+			if start in marks and end in marks:
+				transition['phases'][phase] = marks[end] - marks[start]
+
+		self.completed.append(transition)
+		del self.completed[:-self.history]
+		return transition
+
+	def summary(self):
+		summary = {}
+		for kind in sorted(set(t['kind'] for t in self.completed)):
+			transitions = [t for t in self.completed if t['kind'] == kind]
+			summary[kind] = {'count': len(transitions)}
+			for phase in self.phases:
+				values = [t['phases'][phase] for t in transitions if phase in t['phases']]
+				if len(values) > 0:
+					summary[kind][phase] = {'p50': percentile(values, .5), 'p95': percentile(values, .95)}
+
+		return summary
+
+	def dump(self, path, **extra):
+		data = {
+			'summary': self.summary(),
+			'transitions': [{k: v for k, v in t.items() if k != 'marks'} for t in self.completed],
+		}
+		data.update(extra)
+		with open(path, 'w') as statsFile:
+			json.dump(data, statsFile, indent='\t')
+
+class CallbackTimings():
+	def __init__(self, window, bucketCount):
+		self.calls = 0
+		self.sampled = 0
+		self.total = 0
+		self.samples = collections.deque(maxlen=window)
+		self.histogram = [0] * bucketCount
+
+class CallbackProfiler():
+	# upper bounds of the histogram buckets; anything slower lands in a last, open-ended one
+	bucketEdges = [.00005, .0001, .00025, .0005, .001, .0025, .005, .01, 1 / 60, 1 / 30, .1]
+
+	def __init__(self, sampleEvery=0, window=2000):
+		self.sampleEvery = sampleEvery
+		self.window = window
+		self.timings = {}
+		self._lock = threading.Lock()
+
+	def configure(self, sampleEvery):
+		self.sampleEvery = max(0, int(sampleEvery))
+
+	def isEnabled(self):
+		return self.sampleEvery > 0
+
+	def _timingsFor(self, name):
+		if name not in self.timings:
+			self.timings[name] = CallbackTimings(self.window, len(self.bucketEdges) + 1)
+		return self.timings[name]
+
+	def timed(self, name, func):
+		timings = self._timingsFor(name)
+
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			# unsampled calls only pay for a counter and a modulo
+			timings.calls += 1
+			if self.sampleEvery == 0 or timings.calls % self.sampleEvery != 0:
+				return func(*args, **kwargs)
+
+			start = time.perf_counter()
+			try:
+				return func(*args, **kwargs)
+			finally:
+				self.record(name, time.perf_counter() - start)
+
+		return wrapper
+
+	def record(self, name, seconds):
+		with self._lock:
+			timings = self._timingsFor(name)
+			# the histogram rolls with the window, so the oldest sample drops out as a new one comes in
+			if len(timings.samples) == timings.samples.maxlen:
+				timings.histogram[bisect.bisect_left(self.bucketEdges, timings.samples[0])] -= 1
+			timings.samples.append(seconds)
+			timings.histogram[bisect.bisect_left(self.bucketEdges, seconds)] += 1
+			timings.sampled += 1
+			timings.total += seconds
+
+	def snapshot(self):
+		snapshot = {}
+		with self._lock:
+			for name, timings in self.timings.items():
+				samples = list(timings.samples)
+				snapshot[name] = {
+					'calls': timings.calls,
+					'sampled': timings.sampled,
+					'mean': timings.total / timings.sampled if timings.sampled > 0 else None,
+					'p50': percentile(samples, .5),
+					'p95': percentile(samples, .95),
+					'max': max(samples) if len(samples) > 0 else None,
+					'histogram': list(timings.histogram),
+				}
+		return snapshot
+
+def exportProfile(path, profiles):
+	# profiles maps a process name to a profiler snapshot; the file suffix picks the format
+	path = pathlib.Path(path)
+	edges = CallbackProfiler.bucketEdges
+	if path.suffix.lower() == '.csv':
+		with open(path, 'w', newline='') as profileFile:
+			writer = csv.writer(profileFile)
+			writer.writerow(['process', 'callback', 'calls', 'sampled', 'mean_ms', 'p50_ms', 'p95_ms', 'max_ms'] + ['le_%.3gms' % (edge * 1000) for edge in edges] + ['gt_%.3gms' % (edges[-1] * 1000)])
+			for process, snapshot in profiles.items():
+				for name, timings in sorted((snapshot or {}).items()):
+					times = ['' if timings[key] is None else '%.4f' % (timings[key] * 1000) for key in ['mean', 'p50', 'p95', 'max']]
+					writer.writerow([process, name, timings['calls'], timings['sampled']] + times + timings['histogram'])
+	else:
+		with open(path, 'w') as profileFile:
+			json.dump({'time': time.time(), 'bucket_edges': edges, 'profiles': profiles}, profileFile, indent='\t')
+
 def decode(text):
 	return text.replace('\\n', '\n').replace('\\t', '\t')
 
-class MessageType(Enum):
-	UI_EVENT = auto()
-	OBS_EVENT = auto()
-	OBS_SETTINGS = auto()
-	LOG = auto()
-	DEBUG = auto()
-	EXCEPTION = auto()
-
-class Message():
-	def __init__(self, messageType, data):
-		self.type = messageType
-		self.data = data
+class MessagePump():
+	def __init__(self, pipe, handler, budget=.005):
+		self.pipe = pipe
+		self.handler = handler
+		self.budget = budget
+
+		self.pumps = 0
+		self.received = 0
+		self.depth = 0
+		self.maxDepth = 0
+		self.backlogged = 0
+		self.lastAge = 0
+		self.maxAge = 0
+		self.meanAge = 0
+
+	def _poll(self):
+		try:
+			return self.pipe.poll()
+		except (EOFError, OSError):
+			return False
+
+	def pump(self):
+		deadline = time.perf_counter() + self.budget
+		batch = []
+		while self._poll():
+			batch.append(self.pipe.recv())
+			if time.perf_counter() > deadline:
+				# leave the rest for the next tick rather than stalling this one
+				if self._poll():
+					self.backlogged += 1
+				break
+
+		self.pumps += 1
+		self.depth = len(batch)
+		self.received += len(batch)
+		if self.depth > self.maxDepth:
+			self.maxDepth = self.depth
+
+		now = time.time()
+		for msg in batch:
+			self._recordAge(now - getattr(msg, 'timestamp', now))
+			self.handler(msg)
+
+		return len(batch)
+
+	def _recordAge(self, age):
+		self.lastAge = age
+		if age > self.maxAge:
+			self.maxAge = age
+		self.meanAge += (age - self.meanAge) * .1
+
+	def getStats(self):
+		return {
+			'pumps': self.pumps,
+			'received': self.received,
+			'depth': self.depth,
+			'max_depth': self.maxDepth,
+			'backlogged': self.backlogged,
+			'last_age': self.lastAge,
+			'max_age': self.maxAge,
+			'mean_age': self.meanAge,
+		}
 
 	def __str__(self):
-		return '[%s] %s' % (self.type, self.data)
+		return 'pumps %(pumps)d, received %(received)d, depth %(depth)d (max %(max_depth)d), age %(mean_age).4fs (max %(max_age).4fs)' % self.getStats()
 
 class OBSScriptWithGUI(OBSScript):
+	# values the script publishes through shared memory instead of as messages
+	sharedStateFields = []
+
 	def __init__(self, description, GUIClass):
 		super().__init__(description)
 
 		self.GUIClass = GUIClass
 		self.process = None
 		self.pipe = None
+		self.messagePump = None
+		self.startupTimes = []
+		self.prewarmRetryAt = 0
+		self.sharedState = None
+		self.guiProfile = None
+		self.nextProfileAt = 0
+
+	def setupProperties(self):
+		super().setupProperties()
+		self.addProperty('gui_event_wakeup', 'Wake GUI on pipe events instead of polling (reopen window to apply)', True)
+		self.addProperty('prewarm_gui', 'Keep a hidden GUI ready so Show/Hide is instant', False)
 
 	def _setupProperties(self):
 		def toggleWindow(props, prop):
@@ -278,15 +718,23 @@ class OBSScriptWithGUI(OBSScript):
 	def isGUIProcessActive(self):
 		return self.process is not None and self.process.is_alive()
 
+	def startGUIProcess(self, hidden=False):
+		self.debug('Starting new %sinstance' % ('hidden ' if hidden else ''))
+		pipe, childPipe = Pipe()
+		self.pipe = FramedPipe(pipe)
+		self.sharedState = SharedState(self.sharedStateFields)
+		self.messagePump = MessagePump(self.pipe, self.onMessageReceived)
+		wakeupMode = 'event' if self.settings.get('gui_event_wakeup', True) else 'poll'
+		# a pre-warmed window hides instead of closing, so it stays ready
+		keepAlive = self.settings.get('prewarm_gui', False)
+		self.process = Process(target=_bootstrapGUIApp, args=(self.GUIClass, childPipe, wakeupMode, hidden, keepAlive, time.time(), self.sharedState.array))
+		self.process.start()
+
+		self.onGUIProcessStarted()
+
 	def toggleWindow(self):
 		if not self.isGUIProcessActive():
-			self.debug('Starting new instance')
-			pipe, childPipe = Pipe()
-			self.pipe = pipe
-			self.process = Process(target=_bootstrapGUIApp, args=(self.GUIClass, childPipe,))
-			self.process.start()
-
-			self.onGUIProcessStarted()
+			self.startGUIProcess()
 		else:
 			self.debug('Toggle window')
 			self.send(MessageType.UI_EVENT, 'toggle_visibility')
@@ -296,19 +744,18 @@ class OBSScriptWithGUI(OBSScript):
 
 	def onTick(self, seconds):
 		try:
-			isActive = self.isGUIProcessActive() and self.pipe is not None
-			messageWaiting = False
-			if isActive:
-				try:
-					messageWaiting = self.pipe.poll()
-				except:
-					pass
-
-			if messageWaiting:
-				msg = self.pipe.recv()
-				self.onMessageReceived(msg)
+			if self.isGUIProcessActive() and self.messagePump is not None:
+				self.messagePump.pump()
+			elif self.settings.get('prewarm_gui') and time.monotonic() >= self.prewarmRetryAt:
+				# don't respawn in a tight loop if the GUI keeps dying
+				self.prewarmRetryAt = time.monotonic() + 10
+				self.startGUIProcess(hidden=True)
+
+			if self.profiler.isEnabled() and time.monotonic() >= self.nextProfileAt:
+				self.nextProfileAt = time.monotonic() + 1
+				self.send(MessageType.PROFILE, self.profiler.snapshot())
 		except:
-			self.send(MessageType.EXCEPTION, sys.exc_info())
+			self.send(MessageType.EXCEPTION, traceback.format_exc())
 
 	def onMessageReceived(self, message):
 		if message.type == MessageType.LOG:
@@ -317,53 +764,163 @@ class OBSScriptWithGUI(OBSScript):
 			self.debug('[GUI] %s' % message.data)
 		elif message.type == MessageType.EXCEPTION:
 			self.log('[GUI][EXCEPTION] %s' % message.data)
+		elif message.type == MessageType.STARTUP:
+			self.startupTimes.append(message.data)
+			self.log('GUI first frame (%s): %.0fms' % (message.data['mode'], message.data['first_frame'] * 1000))
+		elif message.type == MessageType.PROFILE:
+			self.guiProfile = message.data
 
 	def send(self, msgType, data):
 		if self.isGUIProcessActive():
 			msg = Message(msgType, data)
-			self.debug('Script Sending %s' % msg)
+			if self.settings.get('debug'):
+				self.debug('Script Sending %s' % msg)
 			self.pipe.send(msg)
 
+	def profileSnapshots(self):
+		return {'script': self.profiler.snapshot(), 'gui': self.guiProfile}
+
+	def publishState(self, **values):
+		# frequent state goes through shared memory; the GUI is only poked when no earlier poke is still waiting
+		if self.sharedState is not None:
+			poke = self.sharedState.write(**values)
+			if poke is not None:
+				self.send(MessageType.STATE, poke)
+
 	def onUpdate(self):
 		super().onUpdate()
 		if self.isGUIProcessActive():
-			self.send(MessageType.OBS_SETTINGS, self.settings)
+			# the GUI already has the rest; it merges what it's sent
+			self.send(MessageType.OBS_SETTINGS, {name: self.settings[name] for name in self.changedSettings})
 
 class ScriptGUI():
-	def __init__(self, pipe):
+	pollInterval = int(1000/15)
+	sharedStateFields = []
+
+	def __init__(self, pipe, wakeupMode='poll', hidden=False, keepAlive=False, launchedAt=None, sharedArray=None):
 		try:
-			self.pipe = pipe
+			self.pipe = FramedPipe(pipe)
+			self.wakeupMode = wakeupMode
+			self.wakeups = 0
+			self._drained = threading.Event()
+			self.sharedState = SharedState(self.sharedStateFields, sharedArray)
+			self.messagePump = MessagePump(self.pipe, self.onMessageReceived)
+			self.settings = {}
+			self.profiler = CallbackProfiler()
+			self.nextProfileAt = 0
+			# both the poll timer and the pipe wakeup go through _pump
+			self._pump = self.profiler.timed('gui_tick', self._pump)
+
+			# time to first frame is measured from the launch for a cold start, or the show request for a warm one
+			self.launchedAt = launchedAt
+			self.bootedAt = time.time()
+			self.startupMode = 'cold'
+			self.showRequestedAt = None if hidden else launchedAt
+
 			self.root = tkinter.Tk()
+			if hidden:
+				self.root.withdraw()
+			if keepAlive:
+				self.root.protocol('WM_DELETE_WINDOW', self.root.withdraw)
+			self.root.bind('<Map>', self._onMap)
 			self.initGUI(self.root)
-			self.settings = {}
+			self.initializedAt = time.time()
 		except Exception as exc:
 			self.exception(exc)
 
+	def _onMap(self, event):
+		if event.widget is self.root and self.showRequestedAt is not None:
+			# idle callbacks run once Tk has drawn the window
+			self.root.after_idle(self._reportFirstFrame)
+
+	def _reportFirstFrame(self):
+		if self.showRequestedAt is None:
+			return
+
+		startup = {'mode': self.startupMode, 'first_frame': time.time() - self.showRequestedAt}
+		if self.startupMode == 'cold' and self.launchedAt is not None:
+			startup['spawn_and_import'] = self.bootedAt - self.launchedAt
+			startup['init_gui'] = self.initializedAt - self.bootedAt
+
+		self.showRequestedAt = None
+		self.send(MessageType.STARTUP, startup)
+
 	def _tick(self):
 		try:
-			self.root.after(int(1000/15), self._tick)
+			self.root.after(self.pollInterval, self._tick)
+			self._pump()
+		except Exception as exc:
+			self.exception(exc)
 
-			if self.pipe.poll():
-				msg = self.pipe.recv()
-				self.onMessageReceived(msg)
+	def _startEventWakeup(self):
+		if hasattr(self.root.tk, 'createfilehandler'):
+			# posix Tk can watch the pipe's descriptor directly
+			self.root.tk.createfilehandler(self.pipe.fileno(), tkinter.READABLE, lambda fd, mask: self._onPipeReadable())
+		else:
+			# windows Tk has no file handlers, so a helper thread blocks on the
+			# pipe and posts a virtual event into the Tk event queue
+			self.root.bind('<<PipeReadable>>', lambda event: self._onPipeReadable())
+			threading.Thread(target=self._waitForPipe, name='PipeWakeup', daemon=True).start()
 
-			self.onTick()
+	def _waitForPipe(self):
+		try:
+			while True:
+				self._drained.clear()
+				if self.pipe.poll(None):
+					self.root.event_generate('<<PipeReadable>>', when='tail')
+					self._drained.wait()
+		except (EOFError, OSError, RuntimeError, tkinter.TclError):
+			pass
+
+	def _onPipeReadable(self):
+		try:
+			self.wakeups += 1
+			self._pump()
 		except Exception as exc:
 			self.exception(exc)
+		finally:
+			self._drained.set()
+
+	def _pump(self):
+		maxDepth = self.messagePump.maxDepth
+		self.messagePump.pump()
+		if self.messagePump.maxDepth > maxDepth:
+			self.debug('Message pump: %s' % self.messagePump)
+
+		self.onTick()
+
+		if self.profiler.isEnabled() and time.monotonic() >= self.nextProfileAt:
+			self.nextProfileAt = time.monotonic() + 1
+			self.send(MessageType.PROFILE, self.profiler.snapshot())
 
 	def onTick(self):
 		pass
 
 	def onMessageReceived(self, message):
 		if message.type == MessageType.OBS_SETTINGS:
-			self.settings = message.data
+			self.settings.update(message.data)
+			if 'profile_sample_every' in message.data:
+				self.profiler.configure(message.data['profile_sample_every'])
+		elif message.type == MessageType.PROFILE:
+			self.onProfile(message.data, self.profiler.snapshot())
+		elif message.type == MessageType.STATE:
+			self.onSharedState(self.sharedState.read(message.data))
 		elif message.type == MessageType.UI_EVENT:
 			if message.data == 'toggle_visibility':
 				if self.root.winfo_viewable():
 					self.root.withdraw()
 				else:
+					if self.showRequestedAt is None:
+						self.startupMode = 'warm'
+						self.showRequestedAt = message.timestamp
 					self.root.deiconify()
 
+	def onSharedState(self, values):
+		pass
+
+	def onProfile(self, scriptProfile, guiProfile):
+		pass
+
 	def send(self, msgType, data):
 		self.pipe.send(Message(msgType, data))
 
@@ -380,14 +937,19 @@ class ScriptGUI():
 		self.send(MessageType.DEBUG, data)
 
 	def run(self):
-		self.debug('Starting up')
+		self.debug('Starting up (%s wakeup)' % self.wakeupMode)
 		try:
-			self._tick()
+			if self.wakeupMode == 'event':
+				self._startEventWakeup()
+				self._pump()
+			else:
+				self._tick()
 			self.root.mainloop()
-			self.debug('GUI exited gracefully')
+			# message age under each wakeup mode is the latency comparison
+			self.debug('GUI exited gracefully, %s wakeup, %d wakeups, message pump: %s' % (self.wakeupMode, self.wakeups, self.messagePump))
 		except Exception as exc:
 			self.exception(exc)
 
-def _bootstrapGUIApp(GUIClass, pipe):
-	app = GUIClass(pipe)
+def _bootstrapGUIApp(GUIClass, pipe, wakeupMode='poll', hidden=False, keepAlive=False, launchedAt=None, sharedArray=None):
+	app = GUIClass(pipe, wakeupMode, hidden, keepAlive, launchedAt, sharedArray)
 	app.run()
\ No newline at end of file
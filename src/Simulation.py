@@ -0,0 +1,340 @@
+import sys
+import json
+import time
+import random
+import shutil
+import pathlib
+import argparse
+import tempfile
+import contextlib
+import subprocess
+
+# the stand-ins for obspython and system_hotkey have to win over anything installed
+headlessFolder = pathlib.Path(__file__).resolve().parent / 'headless'
+sys.path.insert(0, str(headlessFolder))
+
+import obspython as obs
+import system_hotkey
+
+import IPC
+from IPC import MessageType, Message
+from OBSScriptLib import percentile
+import KROZControlDeck
+from KROZControlDeck import RecorderState
+
+frameInterval = 1 / 60
+
+class HeadlessGUI():
+	# takes the place of the Tk window: notes how old every message is when it arrives,
+	# and presses its buttons when the simulation asks it to
+	def __init__(self, pipe, wakeupMode='event', hidden=False, keepAlive=False, launchedAt=None, sharedArray=None):
+		self.pipe = IPC.FramedPipe(pipe)
+		self.sharedState = IPC.SharedState(KROZControlDeck.sharedStateFields, sharedArray)
+		self.launchedAt = launchedAt
+		self.ages = {}
+
+	def run(self):
+		if self.launchedAt is not None:
+			self.pipe.send(Message(MessageType.STARTUP, {'mode': 'cold', 'first_frame': time.time() - self.launchedAt}))
+
+		while True:
+			try:
+				message = self.pipe.recv()
+			except (EOFError, OSError):
+				break
+
+			self.ages.setdefault(message.type.name, []).append(time.time() - message.timestamp)
+			if message.type == MessageType.STATE:
+				self.sharedState.read(message.data)
+			elif message.type == MessageType.OBS_EVENT and message.data == obs.OBS_FRONTEND_EVENT_EXIT:
+				break
+			elif message.type == MessageType.UI_EVENT and message.data == 'report':
+				self.pipe.send(Message(MessageType.STATS, {'ages': self.ages, 'gaps': self.pipe.gaps}))
+			elif message.type == MessageType.UI_EVENT and message.data.startswith('press:'):
+				self.pipe.send(Message(MessageType.UI_EVENT, message.data[len('press:'):]))
+
+def makeScenario(hours, seed, resetShare=.3, minTake=60, maxTake=300):
+	# one step per take: how long it runs, what ends it and where the command comes from
+	generator = random.Random(seed)
+	steps = []
+	total = 0
+	while total < hours * 3600:
+		take = generator.uniform(minTake, maxTake)
+		steps.append({
+			'take': take,
+			'command': 'reset' if generator.random() < resetShare else 'checkpoint',
+			'source': generator.choice(['hotkey', 'gui']),
+		})
+		total += take
+	return steps
+
+def renderWith(ffmpegPath):
+	# a real ffmpeg can't read filler, so each take is rendered as a test pattern once it's over
+	def render(path, duration):
+		command = [str(pathlib.Path(ffmpegPath) / 'ffmpeg'), '-y', '-v', 'error',
+			'-f', 'lavfi', '-i', 'testsrc2=size=320x180:rate=30', '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000',
+			'-t', '%.3f' % max(duration, .1), '-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac', str(path)]
+		subprocess.run(command, stdin=subprocess.DEVNULL, check=True)
+	return render
+
+def summarize(values):
+	if len(values) == 0:
+		return None
+	return {'count': len(values), 'p50': percentile(values, .5), 'p95': percentile(values, .95), 'max': max(values)}
+
+class Simulation():
+	def __init__(self, folder, scenario, ffmpegPath=None, timeScale=300., bitrate=50000, overrides=None, timeout=None):
+		self.folder = pathlib.Path(folder)
+		self.scenario = scenario
+		self.ffmpegPath = ffmpegPath
+		self.timeScale = timeScale
+		self.bitrate = bitrate
+		self.overrides = overrides or {}
+		self.timeout = timeout
+
+		self.script = KROZControlDeck.scriptInstance
+		self.tickTimes = []
+		self.scriptAges = []
+		self.guiReport = None
+		self.jobs = []
+		self.jobTimes = {}
+
+	def configure(self):
+		output = obs.recordingOutput
+		output.directory = self.folder
+		output.timeScale = self.timeScale
+		output.bitrate = self.bitrate
+		if self.ffmpegPath is not None:
+			output.renderCapture = renderWith(self.ffmpegPath)
+
+		self.script.GUIClass = HeadlessGUI
+
+		# messages from the GUI are timed before the script handles them, and its report is kept
+		handle = self.script.onMessageReceived
+		def onMessageReceived(message):
+			self.scriptAges.append(time.time() - message.timestamp)
+			if message.type == MessageType.STATS:
+				self.guiReport = message.data
+			else:
+				handle(message)
+		self.script.onMessageReceived = onMessageReceived
+
+		submit = self.script.combineJobs.submit
+		def submitJob(job):
+			self.jobs.append(job)
+			return submit(job)
+		self.script.combineJobs.submit = submitJob
+
+		settings = obs.obs_data_create()
+		KROZControlDeck.script_defaults(settings)
+		values = {
+			'video_path': str(self.folder),
+			'ffmpeg_path': str(self.ffmpegPath or headlessFolder),
+			'open_immediately': True,
+			'prewarm_gui': False,
+		}
+		values.update(self.overrides)
+		for name, value in values.items():
+			if isinstance(value, bool):
+				obs.obs_data_set_bool(settings, name, value)
+			elif isinstance(value, int):
+				obs.obs_data_set_int(settings, name, value)
+			elif isinstance(value, float):
+				obs.obs_data_set_double(settings, name, value)
+			else:
+				obs.obs_data_set_string(settings, name, value)
+		return settings
+
+	def tick(self):
+		obs.pump()
+		start = time.perf_counter()
+		KROZControlDeck.script_tick(frameInterval)
+		self.tickTimes.append(time.perf_counter() - start)
+
+		for job in self.jobs:
+			times = self.jobTimes.setdefault(job.id, {})
+			if job.state.name == 'RUNNING' and 'started' not in times:
+				times['started'] = time.monotonic()
+			elif job.state.name in ('COMPLETE', 'FAILED', 'CANCELLED') and 'finished' not in times:
+				times['finished'] = time.monotonic()
+
+	def waitFor(self, condition, deadline):
+		nextFrame = time.monotonic()
+		while not condition():
+			if deadline is not None and time.monotonic() > deadline:
+				raise TimeoutError('The simulation stalled with the recorder %s' % self.script.recorderState.name)
+			self.tick()
+			nextFrame += frameInterval
+			time.sleep(max(0, nextFrame - time.monotonic()))
+
+	def press(self, command, source):
+		if source == 'hotkey' and command in KROZControlDeck.hotkeySettings.values():
+			setting = [name for name, hotkeyCommand in KROZControlDeck.hotkeySettings.items() if hotkeyCommand == command][0]
+			system_hotkey.press(self.script.hotkeyKeys[setting])
+		else:
+			self.script.send(MessageType.UI_EVENT, 'press:' + ('click' if command == 'toggle' else command))
+
+	def isRecording(self, take=0):
+		output = obs.recordingOutput
+		return self.script.recorderState == RecorderState.RECORDING and output.isActive() and output.contentSeconds >= take
+
+	def run(self):
+		deadline = None if self.timeout is None else time.monotonic() + self.timeout
+		settings = self.configure()
+		KROZControlDeck.script_load(settings)
+		# marker mode never restarts the recording, so takes are measured from the last marker
+		markerMode = self.script.settings['marker_mode']
+		try:
+			self.waitFor(lambda: self.script.isGUIProcessActive(), deadline)
+			started = time.monotonic()
+
+			self.press('toggle', 'gui')
+			counts = {}
+			for step in self.scenario:
+				self.waitFor(lambda: self.isRecording(), deadline)
+				takeStart = obs.recordingOutput.contentSeconds if markerMode else 0
+				self.waitFor(lambda: self.isRecording(takeStart + step['take']), deadline)
+				take = obs.recordingOutput.path
+				self.press(step['command'], step['source'])
+				counts[step['command']] = counts.get(step['command'], 0) + 1
+				if not markerMode:
+					# wait for the restart before timing the next take
+					self.waitFor(lambda: self.isRecording() and obs.recordingOutput.path != take, deadline)
+
+			self.press('combine', 'gui')
+			self.waitFor(lambda: len(self.jobs) > 0 and not self.script.combineJobs.isBusy() and self.script.recorderState == RecorderState.IDLE, deadline)
+			for _ in range(10):
+				self.tick()
+			finished = time.monotonic()
+
+			self.script.send(MessageType.UI_EVENT, 'report')
+			reportDeadline = time.monotonic() + 5
+			self.waitFor(lambda: self.guiReport is not None or time.monotonic() > reportDeadline, None)
+		finally:
+			# unloading terminates the GUI process, which would otherwise keep a failed run alive
+			KROZControlDeck.script_unload()
+			obs.shutdown()
+
+		return self.results(finished - started, counts)
+
+	def results(self, elapsed, counts):
+		processedFolder = self.folder / 'processed'
+		combines = []
+		for job in self.jobs:
+			times = self.jobTimes.get(job.id, {})
+			inputBytes = 0
+			for path in job.inputs:
+				path = pathlib.Path(path)
+				if not path.exists():
+					path = processedFolder / path.name
+				if path.exists():
+					inputBytes += path.stat().st_size
+			seconds = times.get('finished', 0) - times.get('started', 0)
+			combines.append({
+				'id': job.id,
+				'kind': job.kind,
+				'state': job.state.name,
+				'inputs': len(job.inputs),
+				'bytes': inputBytes,
+				'seconds': seconds,
+				'rate': inputBytes / seconds if seconds > 0 else None,
+				'error': None if job.error is None else str(job.error),
+			})
+
+		guiAges = []
+		if self.guiReport is not None:
+			for ages in self.guiReport['ages'].values():
+				guiAges += ages
+
+		return {
+			'simulated': sum(step['take'] for step in self.scenario),
+			'elapsed': elapsed,
+			'takes': len(self.scenario),
+			'commands': counts,
+			'tick': summarize(self.tickTimes),
+			'ipc': {'to_gui': summarize(guiAges), 'to_script': summarize(self.scriptAges), 'gaps': None if self.guiReport is None else self.guiReport['gaps']},
+			'queue': self.script.commands.summary(),
+			'transitions': self.script.transitions.summary(),
+			'combines': combines,
+			'profile': self.script.profileSnapshots(),
+		}
+
+def formatTimes(summary, count=None):
+	if summary is None:
+		return 'n/a'
+	text = 'p50 %8.2fms  p95 %8.2fms' % (summary['p50'] * 1000, summary['p95'] * 1000)
+	if 'max' in summary:
+		text += '  max %8.2fms' % (summary['max'] * 1000)
+	return text + '  (%d)' % summary.get('count', count)
+
+def printResults(results):
+	commands = ', '.join('%d %s' % (count, name) for name, count in sorted(results['commands'].items()))
+	print('simulated   %.1fh in %d takes (%s), %.1fs wall' % (results['simulated'] / 3600, results['takes'], commands, results['elapsed']))
+	print('tick        %s' % formatTimes(results['tick']))
+	print('ipc -> gui  %s' % formatTimes(results['ipc']['to_gui']))
+	print('ipc <- gui  %s' % formatTimes(results['ipc']['to_script']))
+	if 'latency' in results['queue']:
+		print('queued      %s' % formatTimes(results['queue']['latency'], results['queue']['executed']))
+
+	for kind, phases in results['transitions'].items():
+		for phase in ['gap', 'total']:
+			if phase in phases:
+				print('%-11s %s' % ('%s %s' % (kind, phase), formatTimes(phases[phase], phases['count'])))
+
+	for process, snapshot in results['profile'].items():
+		for name, timings in sorted((snapshot or {}).items()):
+			if timings['sampled'] > 0:
+				print('%-11s %s' % (name[:11], formatTimes(timings, timings['sampled'])))
+
+	for combine in results['combines']:
+		line = '%-11s %s, %d inputs, %s in %.1fs' % ('%s %d' % (combine['kind'], combine['id']), combine['state'].lower(), combine['inputs'], KROZControlDeck.VideoCombiner.formatBytes(combine['bytes']), combine['seconds'])
+		if combine['rate'] is not None:
+			line += ' (%s/s)' % KROZControlDeck.VideoCombiner.formatBytes(combine['rate'])
+		if combine['error'] is not None:
+			line += ': ' + combine['error']
+		print(line)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Replay checkpoint/reset sessions against a headless OBS and report what they cost')
+	parser.add_argument('--hours', type=float, default=2, help='simulated recording time')
+	parser.add_argument('--seed', type=int, default=1)
+	parser.add_argument('--scenario', help='JSON list of {"take": seconds, "command": "checkpoint"|"reset", "source": "hotkey"|"gui"}')
+	parser.add_argument('--time-scale', type=float, default=300, help='simulated seconds per real second while recording')
+	parser.add_argument('--bitrate', type=int, default=50000, help='bytes per simulated second written by the fake output')
+	parser.add_argument('--ffmpeg', help='folder with a real ffmpeg; the stub in headless/ is used otherwise')
+	parser.add_argument('--folder', help='video folder to record into (a temporary one is used otherwise)')
+	parser.add_argument('--keep', action='store_true', help='keep the video folder afterwards')
+	parser.add_argument('--setting', action='append', default=[], metavar='NAME=JSON', help='override a script setting, e.g. reencode_combine=true')
+	parser.add_argument('--timeout', type=float, default=3600)
+	parser.add_argument('--json', help='also write the results here')
+	parser.add_argument('--verbose', action='store_true', help='show the script log instead of writing it to the video folder')
+	args = parser.parse_args()
+
+	if args.scenario is not None:
+		with open(args.scenario) as scenarioFile:
+			scenario = json.load(scenarioFile)
+	else:
+		scenario = makeScenario(args.hours, args.seed)
+
+	overrides = {}
+	for setting in args.setting:
+		name, value = setting.split('=', 1)
+		overrides[name] = json.loads(value)
+
+	folder = pathlib.Path(args.folder or tempfile.mkdtemp(prefix='kroz-simulation-'))
+	folder.mkdir(parents=True, exist_ok=True)
+	simulation = Simulation(folder, scenario, args.ffmpeg, args.time_scale, args.bitrate, overrides, args.timeout)
+	try:
+		if args.verbose:
+			results = simulation.run()
+		else:
+			with open(folder / 'script-log.txt', 'w') as logFile, contextlib.redirect_stdout(logFile):
+				results = simulation.run()
+	finally:
+		if not args.keep and args.folder is None:
+			shutil.rmtree(folder, ignore_errors=True)
+
+	printResults(results)
+	if args.json is not None:
+		with open(args.json, 'w') as jsonFile:
+			json.dump(results, jsonFile, indent='\t')
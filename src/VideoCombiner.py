@@ -0,0 +1,1645 @@
+import subprocess
+import os
+import threading
+import queue
+import itertools
+import pathlib
+import time
+import json
+import re
+import hashlib
+import concurrent.futures
+from datetime import datetime
+
+from enum import Enum, auto
+
+import FileTools
+
+class JobState(Enum):
+	QUEUED = auto()
+	RUNNING = auto()
+	COMPLETE = auto()
+	FAILED = auto()
+	CANCELLED = auto()
+
+class JobCancelled(Exception):
+	pass
+
+# encodes are CPU bound, so however many jobs are running they share one slot per core
+cpuSlots = threading.BoundedSemaphore(os.cpu_count() or 1)
+
+# running jobs reserve what they will write, so parallel sessions don't all count the same free space
+spaceLedger = FileTools.SpaceLedger()
+spaceMargin = 512 * 1024 * 1024
+
+defaultEncoder = {'codec': 'libx264', 'preset': 'veryfast', 'crf': 23, 'chunk': 300, 'audio_bitrate': '192k'}
+
+class FFmpegProgress():
+	def __init__(self, expectedBytes=0, interval=.5):
+		self.expectedBytes = expectedBytes
+		self.interval = interval
+		self.startTime = time.monotonic()
+		self.lastReport = 0
+		self.fields = {}
+
+	def feed(self, line):
+		line = line.strip()
+		if '=' not in line:
+			return None
+
+		key, value = line.split('=', 1)
+		self.fields[key.strip()] = value.strip()
+		if key != 'progress':
+			return None
+
+		now = time.monotonic()
+		finished = value == 'end'
+		if not finished and now - self.lastReport < self.interval:
+			return None
+
+		self.lastReport = now
+		return self.snapshot(now, finished)
+
+	def snapshot(self, now=None, finished=False):
+		if now is None:
+			now = time.monotonic()
+		elapsed = max(now - self.startTime, 1e-6)
+
+		written = self._int('total_size')
+		outTime = self._int('out_time_us', self._int('out_time_ms')) / 1000000
+		rate = written / elapsed
+
+		progress = {
+			'bytes': written,
+			'expected_bytes': self.expectedBytes,
+			'out_time': outTime,
+			'speed': self.fields.get('speed', 'N/A'),
+			'rate': rate,
+			'elapsed': elapsed,
+			'eta': None,
+			'percent': None,
+			'finished': finished,
+		}
+
+		if self.expectedBytes > 0:
+			progress['percent'] = min(100.0, 100.0 * written / self.expectedBytes)
+			if finished:
+				progress['percent'] = 100.0
+				progress['eta'] = 0
+			elif rate > 0:
+				progress['eta'] = max(0, self.expectedBytes - written) / rate
+
+		return progress
+
+	def _int(self, key, default=0):
+		try:
+			return int(self.fields[key])
+		except (KeyError, ValueError):
+			return default
+
+def formatBytes(count):
+	for unit in ['B', 'KB', 'MB', 'GB']:
+		if abs(count) < 1024:
+			return '%.1f %s' % (count, unit)
+		count /= 1024
+	return '%.1f TB' % count
+
+def formatDuration(seconds):
+	seconds = int(seconds)
+	return '%d:%02d:%02d' % (seconds // 3600, (seconds // 60) % 60, seconds % 60)
+
+def markersPathFor(capturePath):
+	capturePath = pathlib.Path(capturePath)
+	return capturePath.with_name(capturePath.name + '.markers.json')
+
+class MarkerLog():
+	def __init__(self):
+		self.markers = []
+
+	def add(self, kind, offset):
+		self.markers.append({'kind': kind, 'time': offset})
+
+	def clear(self):
+		self.markers = []
+
+	def save(self, capturePath, duration=None):
+		markersPath = markersPathFor(capturePath)
+		with markersPath.open('w') as markersFile:
+			json.dump({'markers': self.markers, 'duration': duration}, markersFile, indent='\t')
+
+		self.clear()
+		return markersPath
+
+def loadMarkers(capturePath):
+	markersPath = markersPathFor(capturePath)
+	if not markersPath.exists():
+		return None
+
+	with markersPath.open() as markersFile:
+		return json.load(markersFile)
+
+def keptRanges(markers):
+	# footage up to a checkpoint is kept, footage between the last checkpoint
+	# and a reset is thrown away, and whatever follows the last marker is kept
+	ranges = []
+	segmentStart = 0
+	for marker in sorted(markers, key=lambda m: m['time']):
+		if marker['kind'] == 'checkpoint':
+			if len(ranges) > 0 and ranges[-1][1] == segmentStart:
+				ranges[-1] = (ranges[-1][0], marker['time'])
+			elif marker['time'] > segmentStart:
+				ranges.append((segmentStart, marker['time']))
+		segmentStart = marker['time']
+
+	if len(ranges) > 0 and ranges[-1][1] == segmentStart:
+		ranges[-1] = (ranges[-1][0], None)
+	else:
+		ranges.append((segmentStart, None))
+
+	return ranges
+
+def concatEntry(path, inpoint=None, outpoint=None):
+	entry = 'file \'%s\'\n' % str(path).replace('\'', '\'\\\'\'')
+	if inpoint:
+		entry += 'inpoint %.3f\n' % inpoint
+	if outpoint is not None:
+		entry += 'outpoint %.3f\n' % outpoint
+	return entry
+
+def writeConcatList(captures, listPath, sources=None):
+	# markers belong to the original capture even when a remuxed copy is what gets concatenated
+	if sources is None:
+		sources = captures
+
+	expectedBytes = 0
+	with listPath.open('w') as listFile:
+		for c, source in zip(captures, sources):
+			size = c.stat().st_size
+			markerData = loadMarkers(source)
+			if markerData is None or len(markerData['markers']) == 0:
+				listFile.write(concatEntry(c))
+				expectedBytes += size
+				continue
+
+			# marker mode recordings are cut down to their kept ranges by stream copy
+			duration = markerData.get('duration')
+			for start, end in keptRanges(markerData['markers']):
+				listFile.write(concatEntry(c, start, end))
+				if duration:
+					keptEnd = duration if end is None else end
+					expectedBytes += int(size * max(0, keptEnd - start) / duration)
+				else:
+					expectedBytes += size
+
+	return expectedBytes
+
+def planChunks(captures, probeCache, chunkLength):
+	# every kept range between checkpoints is encoded on its own, and long ones are cut into fixed-length chunks
+	chunks = []
+	for capture in captures:
+		duration = probeCache.probe(capture)['duration']
+		markerData = loadMarkers(capture)
+		if markerData is None or len(markerData['markers']) == 0:
+			ranges = [(0, None)]
+		else:
+			ranges = keptRanges(markerData['markers'])
+
+		for rangeStart, rangeEnd in ranges:
+			rangeEnd = duration if rangeEnd is None else min(rangeEnd, duration)
+			start = rangeStart
+			while rangeEnd - start > .001:
+				# don't leave a sliver of a chunk at the end of a range
+				end = rangeEnd if rangeEnd - start < chunkLength * 1.5 else start + chunkLength
+				chunks.append({'source': str(capture), 'start': start, 'duration': end - start, 'path': None, 'ready': False})
+				start = end
+
+	for index, chunk in enumerate(chunks):
+		chunk['path'] = 'chunk-%04d.mkv' % index
+
+	return chunks
+
+def partialPathFor(outputFilePath):
+	# keep the real extension last so ffmpeg still picks the right muxer
+	return outputFilePath.with_name(outputFilePath.stem + '.partial' + outputFilePath.suffix)
+
+def archiveCapture(capture, processedFolder, report):
+	for path in [capture, markersPathFor(capture)]:
+		if path != capture and not path.exists():
+			continue
+
+		try:
+			FileTools.moveFile(path, processedFolder / path.name)
+		except Exception as exc:
+			report(message='Failed to move %s: %s' % (path.name, exc))
+
+class CombineJob():
+	ids = itertools.count(1)
+	kind = 'combine'
+	maxAttempts = 3
+
+	def __init__(self, videoPath, ffmpegPath, captures=None, outputFilePath=None, probeCache=None, statePath=None, ffmpegSlots=None, encoder=None, alternateOutputPath=None):
+		self.id = next(CombineJob.ids)
+		self.videoPath = pathlib.Path(videoPath)
+		self.ffmpegPath = pathlib.Path(ffmpegPath)
+		self.captures = captures
+		self.inputs = []
+		self.outputFilePath = outputFilePath
+		self.probeCache = probeCache
+		self.statePath = None if statePath is None else pathlib.Path(statePath)
+		self.encoder = encoder
+		self.alternateOutputPath = None if not alternateOutputPath else pathlib.Path(alternateOutputPath)
+		self.reservations = []
+
+		self.ffmpegSlots = ffmpegSlots if ffmpegSlots is not None else threading.BoundedSemaphore(2)
+		# stage workers update the state while others save it
+		self.stateLock = threading.Lock()
+
+		self.state = JobState.QUEUED
+		self.processes = set()
+		self.error = None
+		self._cancelled = threading.Event()
+
+	def cancel(self):
+		self._cancelled.set()
+		for process in list(self.processes):
+			if process.poll() is None:
+				process.terminate()
+
+	def isCancelled(self):
+		return self._cancelled.is_set()
+
+	def checkCancelled(self):
+		if self.isCancelled():
+			raise JobCancelled()
+
+	@staticmethod
+	def combinesFolder(videoPath):
+		return FileTools.stateFolder(videoPath) / 'combines'
+
+	@staticmethod
+	def interruptedStates(videoPath):
+		folder = CombineJob.combinesFolder(videoPath)
+		if not folder.is_dir():
+			return []
+		return sorted(folder.glob('*.json'))
+
+	@staticmethod
+	def missingInputs(state):
+		# archived captures have already been moved on; everything else has to still be there
+		return [pathlib.Path(segment['source']) for segment in state['segments'] if not segment['archived'] and not pathlib.Path(segment['source']).exists()]
+
+	@staticmethod
+	def loadState(statePath):
+		with pathlib.Path(statePath).open() as stateFile:
+			return json.load(stateFile)
+
+	def saveState(self, state):
+		FileTools.writeJSON(self.statePath, state, indent='\t')
+
+	def workFolder(self):
+		return self.statePath.with_suffix('')
+
+	def run(self, report):
+		if self.statePath is not None and self.statePath.exists():
+			state = self.loadState(self.statePath)
+			report(message='Resuming %s at the %s stage' % (pathlib.Path(state['output']).name, state['stage']))
+		else:
+			state = self.plan(report)
+
+		self.outputFilePath = pathlib.Path(state['output'])
+		self.inputs = [pathlib.Path(segment['source']) for segment in state['segments']]
+
+		# every stage persists its progress, so an interrupted run picks up where it stopped
+		try:
+			while state['stage'] != 'done':
+				self.checkCancelled()
+				getattr(self, 'stage' + state['stage'].capitalize())(state, report)
+				self.saveState(state)
+		except JobCancelled:
+			# a deliberate cancel shouldn't come back next time, unless captures have already been archived
+			if state['stage'] != 'archive' and not any(segment['archived'] for segment in state['segments']):
+				self.discardState()
+			raise
+		except Exception:
+			# a job that fails the same way every time would otherwise hold up every later combine
+			state['attempts'] = state.get('attempts', 0) + 1
+			if state['attempts'] >= self.maxAttempts:
+				report(message='Giving up on %s after %d attempts' % (self.outputFilePath.name, state['attempts']))
+				self.quarantineState()
+			else:
+				self.saveState(state)
+			raise
+		finally:
+			self.releaseSpace()
+
+		self.discardState()
+
+	def quarantineState(self):
+		# kept out of the way of later combines rather than deleted, since it records which captures were archived
+		if self.statePath.exists():
+			failedFolder = self.statePath.parent / 'failed'
+			failedFolder.mkdir(parents=True, exist_ok=True)
+			os.replace(self.statePath, failedFolder / self.statePath.name)
+		self.discardState()
+
+	def discardState(self):
+		if self.statePath.exists():
+			self.statePath.unlink()
+
+		workFolder = self.workFolder()
+		if workFolder.is_dir():
+			for leftover in workFolder.iterdir():
+				leftover.unlink()
+			workFolder.rmdir()
+
+	def plan(self, report):
+		now = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+
+		path = self.videoPath
+		if self.captures is not None:
+			chapters = [pathlib.Path(c) for c in self.captures if pathlib.Path(c).exists()]
+		else:
+			chapters = FileTools.findLooseCaptures(path)
+		if len(chapters) == 0:
+			raise RuntimeError('No loose videos to combine in %s' % path)
+
+		probeCache = self.getProbeCache()
+		try:
+			checkCompatible(chapters, probeCache)
+			chapterMarks = captureChapters(chapters, probeCache)
+			referenceStreams = self.referenceStreams(chapters, probeCache)
+			chunks = None
+			if self.encoder is not None:
+				chunks = planChunks(chapters, probeCache, self.encoder['chunk'])
+		finally:
+			probeCache.save()
+
+		outputFilePath = self.outputFilePath
+		if outputFilePath is None:
+			outputFilePath = path / f'combined/{now}-combined.mkv'
+
+		strategy = self.chooseStrategy(chapters)
+		if strategy == 'link':
+			outputFilePath = outputFilePath.with_suffix(chapters[0].suffix)
+
+		state = {
+			'stage': 'encode' if strategy == 'encode' else 'segments',
+			'strategy': strategy,
+			'encoder': self.encoder,
+			'chunks': chunks,
+			'output': str(outputFilePath),
+			'chapters': chapterMarks,
+			'reference_streams': referenceStreams,
+			'duration': sum(chapter['duration'] for chapter in chapterMarks),
+			'segments': [{'source': str(c), 'path': str(c), 'ready': False, 'archived': False} for c in chapters],
+		}
+		self.planSpace(state, report)
+		self.reportPlan(state, report)
+
+		self.statePath = self.combinesFolder(path) / (pathlib.Path(state['output']).stem + '.json')
+		self.saveState(state)
+		return state
+
+	def referenceStreams(self, captures, probeCache):
+		# the full layout most captures share is kept, so identical multi-track captures are joined as they are;
+		# only when some capture can't supply it does everything come down to the essential streams
+		layouts = [probeCache.probe(capture)['streams'] for capture in captures]
+		candidates = []
+		for layout in layouts:
+			if layout not in candidates:
+				candidates.append(layout)
+		candidates.sort(key=layouts.count, reverse=True)
+
+		for layout in candidates:
+			if all(layoutMaps(streams, layout) is not None for streams in layouts):
+				return layout
+		return essentialStreams(layouts[0])
+
+	def chooseStrategy(self, captures):
+		if self.encoder is not None:
+			return 'encode'
+
+		# a single uncut Matroska capture doesn't need ffmpeg at all
+		if len(captures) == 1 and captures[0].suffix.lower() == '.mkv':
+			markerData = loadMarkers(captures[0])
+			if markerData is None or keptRanges(markerData['markers']) == [(0, None)]:
+				return 'link'
+		return 'concat'
+
+	def estimateIO(self, state):
+		sizes = [pathlib.Path(segment['source']).stat().st_size for segment in state['segments']]
+		total = sum(sizes)
+		estimate = {'read': 0, 'written': 0, 'output': 0, 'work': 0, 'processed': 0}
+
+		if state['strategy'] == 'concat':
+			probeCache = self.getProbeCache()
+			reference = state.get('reference_streams')
+			remuxed = sum(size for size, segment in zip(sizes, state['segments']) if reference is not None and needsNormalizing(probeCache.probe(pathlib.Path(segment['source'])), reference))
+			estimate.update(read=total + remuxed, written=total + remuxed, output=total, work=remuxed)
+		elif state['strategy'] == 'encode':
+			# encoded sizes aren't known up front, so plan for the worst case of no saving at all
+			estimate.update(read=2 * total, written=2 * total, output=total, work=total)
+		elif state['strategy'] == 'consume':
+			# each capture is remuxed, appended and moved away before the next, so only the largest is ever doubled up
+			estimate.update(read=2 * total, written=2 * total, output=2 * max(sizes), work=0)
+
+		processedFolder = self.videoPath / 'processed'
+		if not FileTools.isSameDevice(state['segments'][0]['source'], processedFolder):
+			estimate['read'] += total
+			estimate['written'] += total
+			estimate['processed'] = total
+
+		return estimate
+
+	def spaceNeeds(self, state, estimate):
+		needs = [(pathlib.Path(state['output']).parent, estimate['output'])]
+		if estimate['work'] > 0:
+			needs.append((self.combinesFolder(self.videoPath), estimate['work']))
+		if estimate['processed'] > 0:
+			needs.append((self.videoPath / 'processed', estimate['processed']))
+		return needs
+
+	def reserveSpace(self, needs):
+		reservations = []
+		for folder, count in needs:
+			reservation = spaceLedger.reserve(folder, count + spaceMargin)
+			if reservation is None:
+				for reservation in reservations:
+					spaceLedger.release(reservation)
+				return False
+			reservations.append(reservation)
+
+		self.reservations += reservations
+		return True
+
+	def releaseSpace(self):
+		for reservation in self.reservations:
+			spaceLedger.release(reservation)
+		self.reservations = []
+
+	def planSpace(self, state, report):
+		if state['strategy'] == 'link':
+			return
+
+		estimate = self.estimateIO(state)
+		if self.reserveSpace(self.spaceNeeds(state, estimate)):
+			return
+		shortfall = ['%s needed in %s, %s available' % (formatBytes(count + spaceMargin), folder, formatBytes(spaceLedger.available(folder))) for folder, count in self.spaceNeeds(state, estimate)]
+
+		# write the combined file to another volume instead
+		if self.alternateOutputPath is not None:
+			outputFilePath = self.alternateOutputPath / pathlib.Path(state['output']).name
+			suffix = 1
+			while outputFilePath.exists():
+				suffix += 1
+				outputFilePath = self.alternateOutputPath / ('%s-%d%s' % (pathlib.Path(state['output']).stem, suffix, pathlib.Path(state['output']).suffix))
+
+			original = state['output']
+			state['output'] = str(outputFilePath)
+			if self.reserveSpace(self.spaceNeeds(state, estimate)):
+				report(message='Not enough space for %s next to the captures, writing it to %s' % (outputFilePath.name, self.alternateOutputPath))
+				return
+			state['output'] = original
+
+		# archive captures as they're consumed, which only frees space when processed/ is on another volume
+		processedFolder = self.videoPath / 'processed'
+		if state['strategy'] == 'concat' and not FileTools.isSameDevice(state['segments'][0]['source'], processedFolder):
+			consumeState = dict(state, strategy='consume', stage='consume', output=str(pathlib.Path(state['output']).with_suffix('.ts')))
+			if self.reserveSpace(self.spaceNeeds(consumeState, self.estimateIO(consumeState))):
+				state.update(consumeState)
+				report(message='Not enough space for a full copy, appending captures one at a time and archiving each as it is consumed')
+				return
+
+		raise RuntimeError('Not enough free space to combine into %s: %s' % (pathlib.Path(state['output']).name, '; '.join(shortfall)))
+
+	def reportPlan(self, state, report):
+		estimate = self.estimateIO(state)
+		methods = {
+			'link': 'hardlink',
+			'concat': 'stream copy concat',
+			'consume': 'append-and-archive',
+			'encode': 'parallel re-encode (%s) in %d chunk(s)' % (state['encoder']['codec'], len(state['chunks'] or [])) if state['encoder'] else '',
+		}
+		report(message='Plan for %s: %s of %d capture(s)%s, about %s read and %s written' % (
+			pathlib.Path(state['output']).name,
+			methods[state['strategy']],
+			len(state['segments']),
+			', copying to processed/ on another device' if estimate['processed'] > 0 else '',
+			formatBytes(estimate['read']),
+			formatBytes(estimate['written']),
+		))
+
+	def getProbeCache(self):
+		if self.probeCache is None:
+			self.probeCache = ProbeCache.forVideoPath(self.ffmpegPath, self.videoPath)
+		return self.probeCache
+
+	def stageSegments(self, state, report):
+		pending = [segment for segment in state['segments'] if not segment['ready']]
+		progress = {}
+		progressLock = threading.Lock()
+
+		def prepare(index, segment):
+			def segmentReport(**details):
+				if 'progress' not in details:
+					report(**details)
+					return
+				with progressLock:
+					progress[index] = details['progress']
+					report(progress=combineProgress(list(progress.values())))
+
+			self.checkCancelled()
+			self.prepareSegment(segment, state, segmentReport)
+			with self.stateLock:
+				segment['ready'] = True
+				self.saveState(state)
+
+		# ffmpegSlots bounds how many of these actually run ffmpeg at once
+		workers = max(1, min(len(pending), os.cpu_count() or 1))
+		with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+			futures = [pool.submit(prepare, index, segment) for index, segment in enumerate(pending)]
+			for future in futures:
+				future.result()
+
+		state['stage'] = 'concat'
+
+	def prepareSegment(self, segment, state, report):
+		source = pathlib.Path(segment['source'])
+		probeCache = self.getProbeCache()
+		reference = state.get('reference_streams')
+		if reference is None or not needsNormalizing(probeCache.probe(source), reference):
+			return
+
+		# remuxed copies are cached by capture identity, so a resumed or repeated combine reuses them
+		identity = hashlib.sha1(FileTools.fileIdentity(source).encode('utf-8')).hexdigest()[:16]
+		normalizedPath = FileTools.stateFolder(self.videoPath) / 'normalized' / f'{identity}.mkv'
+		with self.stateLock:
+			segment['path'] = str(normalizedPath)
+			segment['normalized'] = True
+		if normalizedPath.exists():
+			report(message='Reusing the remuxed copy of %s' % source.name)
+			return
+
+		normalizedPath.parent.mkdir(parents=True, exist_ok=True)
+		self.workFolder().mkdir(parents=True, exist_ok=True)
+		partialPath = partialPathFor(normalizedPath)
+		streamMaps = layoutMaps(probeCache.probe(source)['streams'], reference)
+		if streamMaps is None:
+			raise RuntimeError('%s does not have the streams %s' % (source.name, describeStreams(reference)))
+
+		ffmpegCommand = [str(self.ffmpegPath / 'ffmpeg'), '-y', '-i', str(source)] + streamMaps + ['-c', 'copy', str(partialPath)]
+		report(message='Remuxing %s to Matroska' % source.name)
+		try:
+			self.runFFmpeg(ffmpegCommand, self.workFolder() / f'remux-{identity}.txt', report, stat.st_size)
+		except:
+			if partialPath.exists():
+				partialPath.unlink()
+			raise
+		os.replace(partialPath, normalizedPath)
+
+	def stageEncode(self, state, report):
+		workFolder = self.workFolder()
+		workFolder.mkdir(parents=True, exist_ok=True)
+
+		chunks = state['chunks']
+		pending = [chunk for chunk in chunks if not chunk['ready']]
+		workers = max(1, min(len(pending), os.cpu_count() or 1))
+		threads = max(1, (os.cpu_count() or 1) // workers)
+		report(message='Encoding %d of %d chunk(s), %d at a time' % (len(pending), len(chunks), workers))
+
+		progress = {}
+		progressLock = threading.Lock()
+		stageStart = time.monotonic()
+		sourceBytes = sum(pathlib.Path(segment['source']).stat().st_size for segment in state['segments'] if pathlib.Path(segment['source']).exists())
+
+		def chunkReport(index, **details):
+			if 'progress' not in details:
+				report(**details)
+				return
+			with progressLock:
+				progress[index] = details['progress']
+				combined = combineProgress(list(progress.values()))
+
+				# encoded sizes aren't known ahead of time, so progress is measured in output time
+				# and expressed as a share of the source bytes, which keeps it comparable with copy jobs
+				done = sum(chunk['duration'] for i, chunk in enumerate(chunks) if chunk['ready'] and i not in progress)
+				outTime = done + sum(min(p['out_time'], chunks[i]['duration']) for i, p in progress.items())
+
+			total = sum(chunk['duration'] for chunk in chunks)
+			if total > 0:
+				elapsed = max(time.monotonic() - stageStart, 1e-6)
+				combined['expected_bytes'] = sourceBytes
+				combined['bytes'] = int(sourceBytes * min(1.0, outTime / total))
+				combined['rate'] = combined['bytes'] / elapsed
+				combined['elapsed'] = elapsed
+				combined['percent'] = 100.0 * combined['bytes'] / sourceBytes if sourceBytes > 0 else None
+				combined['eta'] = max(0, sourceBytes - combined['bytes']) / combined['rate'] if combined['rate'] > 0 else None
+			report(progress=combined)
+
+		def encode(index):
+			chunk = chunks[index]
+			self.checkCancelled()
+			chunkPath = workFolder / chunk['path']
+			partialPath = partialPathFor(chunkPath)
+			ffmpegCommand = [str(self.ffmpegPath / 'ffmpeg'), '-y'] + self.encodeArguments(chunk, state['encoder'], threads) + [str(partialPath)]
+			try:
+				self.runFFmpeg(ffmpegCommand, workFolder / 'encode.txt', lambda **details: chunkReport(index, **details), slots=cpuSlots)
+			except:
+				if partialPath.exists():
+					partialPath.unlink()
+				raise
+
+			os.replace(partialPath, chunkPath)
+			with self.stateLock:
+				chunk['ready'] = True
+				self.saveState(state)
+
+		with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+			futures = [pool.submit(encode, index) for index, chunk in enumerate(chunks) if not chunk['ready']]
+			try:
+				for future in futures:
+					future.result()
+			except:
+				# one chunk failing stops the rest rather than encoding for nothing
+				for future in futures:
+					future.cancel()
+				raise
+
+		state['stage'] = 'concat'
+
+	def encodeArguments(self, chunk, encoder, threads):
+		# seeking on the input is frame accurate when re-encoding, and each chunk starts on a fresh keyframe
+		arguments = ['-ss', '%.3f' % chunk['start'], '-i', chunk['source'], '-t', '%.3f' % chunk['duration']]
+		arguments += ['-map', '0:v:0', '-map', '0:a:0?']
+		arguments += ['-c:v', encoder['codec'], '-preset', encoder['preset'], '-crf', str(encoder['crf']), '-threads', str(threads)]
+		arguments += ['-c:a', 'aac', '-b:a', encoder.get('audio_bitrate', '192k')]
+		return arguments
+
+	def stageConcat(self, state, report):
+		outputFilePath = pathlib.Path(state['output'])
+		outputFilePath.parent.mkdir(parents=True, exist_ok=True)
+		partialPath = partialPathFor(outputFilePath)
+		if partialPath.exists():
+			source = pathlib.Path(state['segments'][0]['source'])
+			if state.get('strategy') == 'link' and not source.exists():
+				# a capture was moved into place before the state could record it; that's the only copy
+				FileTools.moveFile(partialPath, source)
+				state['segments'][0]['archived'] = False
+			else:
+				partialPath.unlink()
+
+		if state.get('strategy') == 'link':
+			self.linkSingleCapture(state, partialPath, report)
+			state['stage'] = 'verify'
+			return
+
+		workFolder = self.workFolder()
+		workFolder.mkdir(parents=True, exist_ok=True)
+		chapterFilePath = workFolder / 'concat.txt'
+		if state.get('strategy') == 'encode':
+			# the chunks are already cut to the kept ranges
+			chunkPaths = [workFolder / chunk['path'] for chunk in state['chunks']]
+			expectedBytes = writeConcatList(chunkPaths, chapterFilePath)
+		else:
+			segmentPaths = [pathlib.Path(segment['path']) for segment in state['segments']]
+			sourcePaths = [pathlib.Path(segment['source']) for segment in state['segments']]
+			expectedBytes = writeConcatList(segmentPaths, chapterFilePath, sourcePaths)
+
+		metadataPath = workFolder / 'chapters.ffmetadata'
+		writeChapterMetadata(state['chapters'], metadataPath)
+
+		ffmpegCommand = [str(self.ffmpegPath / 'ffmpeg'), '-y', '-f', 'concat', '-safe', '0', '-i', str(chapterFilePath), '-i', str(metadataPath), '-map', '0', '-map_chapters', '1', '-c', 'copy', str(partialPath)]
+		report(message=' '.join(ffmpegCommand))
+
+		stdoutPath = outputFilePath.parent / (outputFilePath.stem + '-output.txt')
+		with stdoutPath.open('a') as stdoutFile:
+			stdoutFile.write(str(chapterFilePath) + '\r\n' + chapterFilePath.read_text() + '\r\n********\r\n' + ' '.join(ffmpegCommand) + '\r\n')
+
+		try:
+			self.runFFmpeg(ffmpegCommand, stdoutPath, report, expectedBytes)
+		except:
+			if partialPath.exists():
+				partialPath.unlink()
+			raise
+
+		state['stage'] = 'verify'
+
+	def stageConsume(self, state, report):
+		outputFilePath = pathlib.Path(state['output'])
+		outputFilePath.parent.mkdir(parents=True, exist_ok=True)
+		partialPath = partialPathFor(outputFilePath)
+		workFolder = self.workFolder()
+		workFolder.mkdir(parents=True, exist_ok=True)
+		processedFolder = self.videoPath / 'processed'
+		processedFolder.mkdir(parents=True, exist_ok=True)
+		logPath = outputFilePath.parent / (outputFilePath.stem + '-output.txt')
+		FileTools.truncateFile(partialPath, state.get('bytes', 0))
+
+		for segment in state['segments']:
+			if segment['archived']:
+				continue
+			self.checkCancelled()
+			source = pathlib.Path(segment['source'])
+
+			if not segment.get('appended'):
+				duration = self.appendSegment(source, partialPath, state.get('offset', 0), workFolder, logPath, report, ['-map', '0:v:0', '-map', '0:a:0?'])
+				segment['appended'] = True
+				segment['ready'] = True
+				state['offset'] = state.get('offset', 0) + duration
+				state['bytes'] = partialPath.stat().st_size
+				self.saveState(state)
+
+			archiveCapture(source, processedFolder, report)
+			segment['archived'] = True
+			self.saveState(state)
+
+		writeChapterMetadata(state['chapters'], outputFilePath.with_suffix('.ffmetadata'))
+		state['stage'] = 'verify'
+
+	def appendSegment(self, source, destination, offset, workFolder, logPath, report, maps=None):
+		listPath = workFolder / 'segment.txt'
+		segmentPath = workFolder / 'segment.ts'
+		expectedBytes = writeConcatList([source], listPath)
+
+		# MPEG-TS can be appended to byte for byte; offset the timestamps to carry on where the destination ends
+		ffmpegCommand = [str(self.ffmpegPath / 'ffmpeg'), '-y', '-f', 'concat', '-safe', '0', '-i', str(listPath)] + (maps or []) + ['-c', 'copy', '-output_ts_offset', '%.3f' % offset, '-f', 'mpegts', str(segmentPath)]
+		with logPath.open('a') as logFile:
+			logFile.write(' '.join(ffmpegCommand) + '\r\n')
+
+		try:
+			result = self.runFFmpeg(ffmpegCommand, logPath, report, expectedBytes)
+			FileTools.appendFile(segmentPath, destination)
+		finally:
+			for path in [listPath, segmentPath]:
+				if path.exists():
+					path.unlink()
+		return result['out_time']
+
+	def linkSingleCapture(self, state, partialPath, report):
+		segment = state['segments'][0]
+		try:
+			os.link(segment['path'], partialPath)
+			report(message='Hardlinked %s' % pathlib.Path(segment['path']).name)
+		except OSError:
+			# no hardlinks on this volume: the capture itself becomes the output
+			FileTools.moveFile(segment['path'], partialPath)
+			segment['archived'] = True
+			self.saveState(state)
+			report(message='Moved %s into place' % pathlib.Path(segment['path']).name)
+
+	def stageVerify(self, state, report):
+		outputFilePath = pathlib.Path(state['output'])
+		partialPath = partialPathFor(outputFilePath)
+
+		problem = None
+		if not partialPath.exists() or partialPath.stat().st_size == 0:
+			problem = 'the combined file is missing or empty'
+		elif state['duration'] > 0:
+			duration = self.getProbeCache().probe(partialPath)['duration']
+			tolerance = max(2, state['duration'] * .01)
+			if abs(duration - state['duration']) > tolerance:
+				problem = 'the combined file is %.1fs long, expected %.1fs' % (duration, state['duration'])
+
+		if problem is not None and state['strategy'] == 'consume':
+			# the captures are already archived, so there's nothing to redo from
+			report(message='Warning: %s' % problem)
+			problem = None
+
+		if problem is not None:
+			# go back and redo the concat next time rather than trusting this output; a capture that was
+			# moved into place is the only copy of the recording, so it goes back instead
+			segment = state['segments'][0]
+			if state['strategy'] == 'link' and segment['archived']:
+				if partialPath.exists():
+					FileTools.moveFile(partialPath, pathlib.Path(segment['source']))
+				segment['archived'] = False
+			elif partialPath.exists():
+				partialPath.unlink()
+			state['stage'] = 'concat'
+			self.saveState(state)
+			raise RuntimeError('Verification failed: %s' % problem)
+
+		os.replace(partialPath, outputFilePath)
+		state['stage'] = 'archive'
+
+	def stageArchive(self, state, report):
+		processedFolder = self.videoPath / 'processed'
+		processedFolder.mkdir(parents=True, exist_ok=True)
+
+		for segment in state['segments']:
+			if not segment['archived']:
+				archiveCapture(pathlib.Path(segment['source']), processedFolder, report)
+				segment['archived'] = True
+
+			if segment.get('normalized') and pathlib.Path(segment['path']).exists():
+				pathlib.Path(segment['path']).unlink()
+
+		state['stage'] = 'done'
+
+	def runFFmpeg(self, command, logPath, report, expectedBytes=0, slots=None):
+		self.checkCancelled()
+		if slots is None:
+			slots = self.ffmpegSlots
+
+		# machine readable progress goes to stdout, everything else to the log
+		command = command[:1] + ['-progress', 'pipe:1', '-nostats'] + command[1:]
+		progress = FFmpegProgress(expectedBytes)
+
+		with slots, logPath.open('a') as logFile:
+			self.checkCancelled()
+			process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=logFile, universal_newlines=True)
+			self.processes.add(process)
+			try:
+				if self.isCancelled():
+					process.terminate()
+
+				for line in process.stdout:
+					snapshot = progress.feed(line)
+					if snapshot is not None:
+						report(progress=snapshot)
+				returnCode = process.wait()
+			finally:
+				self.processes.discard(process)
+
+		self.checkCancelled()
+		if returnCode != 0:
+			raise RuntimeError('ffmpeg exited with code %d, see %s' % (returnCode, logPath))
+
+		return progress.snapshot(finished=True)
+
+class RollingMaster():
+	# MPEG-TS can be appended to byte for byte, which Matroska can't
+	folderName = '.rolling'
+
+	def __init__(self, videoPath):
+		self.folder = pathlib.Path(videoPath) / self.folderName
+		self.statePath = self.folder / 'session.json'
+
+	def exists(self):
+		return self.statePath.exists()
+
+	def load(self):
+		if not self.statePath.exists():
+			now = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+			return {'master': f'{now}-rolling.ts', 'bytes': 0, 'duration': 0, 'segments': []}
+
+		with self.statePath.open() as stateFile:
+			state = json.load(stateFile)
+		FileTools.truncateFile(self.masterPath(state), state['bytes'])
+		return state
+
+	def save(self, state):
+		FileTools.writeJSON(self.statePath, state, indent='\t')
+
+	def clear(self):
+		if self.statePath.exists():
+			self.statePath.unlink()
+
+	def masterPath(self, state):
+		return self.folder / state['master']
+
+def writeChapterMetadata(segments, metadataPath):
+	with pathlib.Path(metadataPath).open('w', encoding='utf-8') as metadataFile:
+		metadataFile.write(';FFMETADATA1\n')
+		for index, segment in enumerate(segments):
+			metadataFile.write('\n[CHAPTER]\nTIMEBASE=1/1000\n')
+			metadataFile.write('START=%d\n' % int(segment['start'] * 1000))
+			metadataFile.write('END=%d\n' % int((segment['start'] + segment['duration']) * 1000))
+			metadataFile.write('title=%s\n' % segment.get('title', 'Checkpoint %d' % (index + 1)))
+
+class AppendSegmentJob(CombineJob):
+	kind = 'append'
+
+	def __init__(self, videoPath, ffmpegPath, capturePath):
+		super().__init__(videoPath, ffmpegPath, [capturePath])
+		self.capturePath = pathlib.Path(capturePath)
+		self.inputs = [self.capturePath]
+
+	def run(self, report):
+		if not self.capturePath.exists():
+			raise RuntimeError('%s no longer exists' % self.capturePath.name)
+
+		rolling = RollingMaster(self.videoPath)
+		state = rolling.load()
+		rolling.folder.mkdir(parents=True, exist_ok=True)
+
+		processedFolder = self.videoPath / 'processed'
+		processedFolder.mkdir(parents=True, exist_ok=True)
+
+		# appended before, but not archived before OBS went down
+		if any(segment['name'] == self.capturePath.name for segment in state['segments']):
+			self.outputFilePath = rolling.masterPath(state)
+			archiveCapture(self.capturePath, processedFolder, report)
+			return
+
+		masterPath = rolling.masterPath(state)
+		logPath = rolling.folder / (pathlib.Path(state['master']).stem + '-output.txt')
+		duration = self.appendSegment(self.capturePath, masterPath, state['duration'], rolling.folder, logPath, report)
+
+		state['segments'].append({'name': self.capturePath.name, 'start': state['duration'], 'duration': duration})
+		state['duration'] += duration
+		state['bytes'] = masterPath.stat().st_size
+		rolling.save(state)
+
+		self.outputFilePath = masterPath
+		archiveCapture(self.capturePath, processedFolder, report)
+
+class FinalizeRollingJob(CombineJob):
+	kind = 'finalize'
+
+	def run(self, report):
+		rolling = RollingMaster(self.videoPath)
+		if not rolling.exists():
+			raise RuntimeError('There is no rolling combine to finalize')
+
+		state = rolling.load()
+		if len(state['segments']) == 0:
+			raise RuntimeError('The rolling combine is empty')
+
+		now = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+		outputFilePath = self.videoPath / f'combined/{now}-combined.mkv'
+		outputFilePath.parent.mkdir(parents=True, exist_ok=True)
+		self.outputFilePath = outputFilePath
+
+		masterPath = rolling.masterPath(state)
+		metadataPath = rolling.folder / 'chapters.ffmetadata'
+		writeChapterMetadata(state['segments'], metadataPath)
+
+		# the master is already one continuous stream, so this is a stream copy into Matroska with the chapters added
+		partialPath = partialPathFor(outputFilePath)
+		logPath = rolling.folder / (pathlib.Path(state['master']).stem + '-output.txt')
+		ffmpegCommand = [str(self.ffmpegPath / 'ffmpeg'), '-y', '-i', str(masterPath), '-i', str(metadataPath), '-map', '0', '-map_chapters', '1', '-c', 'copy', str(partialPath)]
+		with logPath.open('a') as logFile:
+			logFile.write(' '.join(ffmpegCommand) + '\r\n')
+
+		# the master and its state stay as they are until the remux has succeeded, so a failure can be retried
+		try:
+			self.runFFmpeg(ffmpegCommand, logPath, report, masterPath.stat().st_size)
+		except:
+			if partialPath.exists():
+				partialPath.unlink()
+			raise
+		finally:
+			metadataPath.unlink()
+		os.replace(partialPath, outputFilePath)
+
+		masterPath.unlink()
+		os.replace(logPath, outputFilePath.parent / (outputFilePath.stem + '-output.txt'))
+		rolling.clear()
+		report(message='Finalized %s with %d chapter(s)' % (outputFilePath.name, len(state['segments'])))
+
+captureTimePattern = re.compile(r'(\d{4})-(\d{2})-(\d{2})[ _T](\d{2})-(\d{2})-(\d{2})')
+
+def captureTimes(path):
+	stat = path.stat()
+	end = stat.st_mtime
+
+	# OBS names recordings after their start time by default
+	match = captureTimePattern.search(path.stem)
+	if match is not None:
+		try:
+			return datetime(*[int(part) for part in match.groups()]).timestamp(), end
+		except ValueError:
+			pass
+
+	# windows reports creation time as ctime; elsewhere the best we have is the end
+	start = stat.st_ctime if os.name == 'nt' else end
+	return min(start, end), end
+
+class ProbeCache():
+	maxEntries = 5000
+	signatureKeys = ['codec_type', 'codec_name', 'width', 'height', 'pix_fmt', 'sample_rate', 'channels']
+	instances = {}
+	instancesLock = threading.Lock()
+
+	def __init__(self, ffmpegPath, cachePath):
+		self.ffmpegPath = pathlib.Path(ffmpegPath)
+		self.cachePath = pathlib.Path(cachePath)
+		self.entries = {}
+		self.dirty = False
+		self._lock = threading.Lock()
+		self._load()
+
+	@staticmethod
+	def forVideoPath(ffmpegPath, videoPath):
+		# the catalog and every combine job share one cache per folder, so one save can't undo another
+		cachePath = (FileTools.stateFolder(videoPath) / 'probe-cache.json').resolve()
+		with ProbeCache.instancesLock:
+			cache = ProbeCache.instances.get(cachePath)
+			if cache is None:
+				cache = ProbeCache(ffmpegPath, cachePath)
+				ProbeCache.instances[cachePath] = cache
+			else:
+				cache.ffmpegPath = pathlib.Path(ffmpegPath)
+		return cache
+
+	def _load(self):
+		try:
+			with self.cachePath.open() as cacheFile:
+				self.entries = json.load(cacheFile)
+		except (OSError, ValueError):
+			self.entries = {}
+
+	def save(self):
+		with self._lock:
+			if not self.dirty:
+				return
+
+			# oldest probes go first when the cache gets too big
+			if len(self.entries) > self.maxEntries:
+				keys = sorted(self.entries, key=lambda key: self.entries[key]['probed'])
+				for key in keys[:len(self.entries) - self.maxEntries]:
+					del self.entries[key]
+
+			# only a cache, so not worth an fsync
+			FileTools.writeJSON(self.cachePath, self.entries, sync=False)
+			self.dirty = False
+
+	def probe(self, path):
+		path = pathlib.Path(path)
+		key = FileTools.fileIdentity(path)
+
+		with self._lock:
+			if key in self.entries:
+				return self.entries[key]
+
+		command = [str(self.ffmpegPath / 'ffprobe'), '-v', 'error', '-show_entries', 'format=duration,format_name:stream=' + ','.join(self.signatureKeys), '-of', 'json', str(path)]
+		result = subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, timeout=60)
+		if result.returncode != 0:
+			raise RuntimeError('ffprobe could not read %s: %s' % (path.name, result.stderr.strip()))
+
+		data = json.loads(result.stdout)
+		try:
+			duration = float(data.get('format', {}).get('duration', 0))
+		except ValueError:
+			duration = 0
+
+		info = {
+			'duration': duration,
+			'format': data.get('format', {}).get('format_name'),
+			'streams': [{k: stream[k] for k in self.signatureKeys if k in stream} for stream in data.get('streams', [])],
+			'probed': time.time(),
+		}
+
+		with self._lock:
+			self.entries[key] = info
+			self.dirty = True
+
+		return info
+
+	def signature(self, path):
+		try:
+			return tuple(tuple(sorted(stream.items())) for stream in essentialStreams(self.probe(path)['streams']))
+		except (OSError, ValueError, RuntimeError, subprocess.SubprocessError):
+			return None
+
+class ThumbnailCache():
+	# first and last frames of captures, kept on disk by capture identity and evicted least recently used first
+	maxEntries = 200
+	width = 80
+
+	def __init__(self, ffmpegPath, videoPath, workers=1):
+		self.ffmpegPath = pathlib.Path(ffmpegPath)
+		self.folder = FileTools.stateFolder(videoPath) / 'thumbnails'
+		self.results = queue.Queue()
+		self.pending = set()
+		self._lock = threading.Lock()
+		# each worker runs one ffmpeg at a time, so this bounds how many are running
+		self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='Thumbnails')
+
+	def request(self, capture):
+		capture = pathlib.Path(capture)
+		with self._lock:
+			if capture in self.pending:
+				return
+			self.pending.add(capture)
+		self.pool.submit(self._extract, capture)
+
+	def getResults(self):
+		results = []
+		while True:
+			try:
+				results.append(self.results.get_nowait())
+			except queue.Empty:
+				return results
+
+	def shutdown(self):
+		self.pool.shutdown(wait=False)
+
+	def pathsFor(self, capture):
+		# keyed by the capture's identity, so a file replaced under the same name gets new thumbnails
+		identity = hashlib.sha1(FileTools.fileIdentity(capture).encode('utf-8')).hexdigest()[:16]
+		return {which: self.folder / f'{identity}-{which}.png' for which in ['first', 'last']}
+
+	def _extract(self, capture):
+		result = {'capture': str(capture), 'name': capture.name}
+		try:
+			paths = self.pathsFor(capture)
+			self.folder.mkdir(parents=True, exist_ok=True)
+			for which, path in paths.items():
+				if path.exists():
+					# a cache hit counts as a use
+					os.utime(path)
+				else:
+					self._render(capture, which, path)
+				result[which] = str(path)
+			self._evict()
+		except (OSError, RuntimeError, subprocess.SubprocessError) as exc:
+			result['error'] = str(exc)
+		finally:
+			with self._lock:
+				self.pending.discard(capture)
+
+		self.results.put(result)
+
+	def _render(self, capture, which, path):
+		if which == 'first':
+			arguments = ['-i', str(capture), '-frames:v', '1']
+		else:
+			# seek to just before the end and keep overwriting the image until the last frame
+			arguments = ['-sseof', '-1', '-i', str(capture), '-update', '1']
+
+		partialPath = partialPathFor(path)
+		command = [str(self.ffmpegPath / 'ffmpeg'), '-y', '-v', 'error', '-threads', '1'] + arguments + ['-an', '-vf', 'scale=%d:-2' % self.width, str(partialPath)]
+		result = subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, timeout=60)
+		if result.returncode != 0 or not partialPath.exists():
+			if partialPath.exists():
+				partialPath.unlink()
+			raise RuntimeError('ffmpeg could not grab the %s frame of %s: %s' % (which, capture.name, result.stderr.strip()))
+		os.replace(partialPath, path)
+
+	def _evict(self):
+		with os.scandir(self.folder) as entries:
+			thumbnails = [(entry.stat().st_mtime, entry.path) for entry in entries if entry.name.endswith('.png') and '.partial' not in entry.name]
+		if len(thumbnails) <= self.maxEntries:
+			return
+
+		thumbnails.sort()
+		for _, path in thumbnails[:len(thumbnails) - self.maxEntries]:
+			try:
+				os.unlink(path)
+			except OSError:
+				pass
+
+class LooseFootageCatalog():
+	# a capture nobody has written to for this long is finished enough to probe
+	settleTime = 3
+	spaceCheckInterval = 5
+
+	def __init__(self, videoPath, ffmpegPath, lowSpaceBytes=10 * 1024**3):
+		self.videoPath = pathlib.Path(videoPath)
+		self.probeCache = ProbeCache.forVideoPath(ffmpegPath, videoPath)
+		self.lowSpaceBytes = lowSpaceBytes
+		self.watcher = FileTools.FolderWatcher(self.videoPath, FileTools.videoExtensions, self.onChange, self.onIdle)
+
+		self.entries = {}
+		self.changes = queue.Queue()
+		self.free = None
+		self.warning = None
+		self.warningChanged = False
+		self.grownBytes = 0
+		self.rate = 0
+		self.lastSpaceCheck = None
+		self._lock = threading.Lock()
+
+	def start(self):
+		self.watcher.start()
+
+	def stop(self):
+		self.watcher.stop()
+
+	def onChange(self, path, key, closed):
+		# runs on the watcher thread
+		name = path.name
+		if key is None:
+			with self._lock:
+				self.entries.pop(name, None)
+			self.changes.put({'name': name, 'removed': True})
+			return
+
+		size, mtime = key
+		with self._lock:
+			entry = self.entries.setdefault(name, {'name': name, 'size': 0, 'duration': None, 'probed': None})
+			self.grownBytes += max(0, size - entry['size'])
+			entry['size'] = size
+			entry['changed'] = time.monotonic()
+			if entry['probed'] != key:
+				entry['duration'] = None
+
+		if closed:
+			self.probe(entry, key)
+			self.probeCache.save()
+		with self._lock:
+			change = self.describe(entry)
+		self.changes.put(change)
+
+	def onIdle(self):
+		now = time.monotonic()
+		with self._lock:
+			settled = [entry for entry in self.entries.values() if entry['duration'] is None and now - entry['changed'] > self.settleTime]
+
+		probed = False
+		for entry in settled:
+			key = self.watcher.entries.get(entry['name'])
+			if key is not None and entry['probed'] != key:
+				probed = self.probe(entry, key) or probed
+				with self._lock:
+					change = self.describe(entry)
+				self.changes.put(change)
+		if probed:
+			self.probeCache.save()
+
+		self.checkSpace()
+
+	def probe(self, entry, key):
+		# a capture that can't be read yet isn't tried again until it changes
+		try:
+			duration = self.probeCache.probe(self.videoPath / entry['name'])['duration']
+		except (OSError, ValueError, RuntimeError, subprocess.SubprocessError):
+			duration = None
+
+		# the tick thread reads entries for totals and snapshots
+		with self._lock:
+			entry['probed'] = key
+			if duration is not None:
+				entry['duration'] = duration
+		return duration is not None
+
+	def checkSpace(self):
+		now = time.monotonic()
+		if self.lastSpaceCheck is not None and now - self.lastSpaceCheck < self.spaceCheckInterval:
+			return
+
+		try:
+			free = spaceLedger.available(self.videoPath)
+		except OSError:
+			return
+
+		# the rate at which loose footage is growing gives a rough idea of how long the space lasts
+		with self._lock:
+			if self.lastSpaceCheck is not None:
+				self.rate = self.grownBytes / (now - self.lastSpaceCheck)
+			self.grownBytes = 0
+			self.lastSpaceCheck = now
+			self.free = free
+
+			if free < self.lowSpaceBytes and self.warning is None:
+				self.warning = 'Only %s free on the video drive' % formatBytes(free)
+				if self.rate > 0:
+					self.warning += ', about %s of recording left' % formatDuration(free / self.rate)
+				self.warningChanged = True
+			elif free > self.lowSpaceBytes * 1.1 and self.warning is not None:
+				# a little headroom before clearing, so it doesn't flap right at the threshold
+				self.warning = None
+				self.warningChanged = True
+
+	def describe(self, entry):
+		return {'name': entry['name'], 'size': entry['size'], 'duration': entry['duration']}
+
+	def totals(self):
+		with self._lock:
+			entries = [self.describe(entry) for entry in self.entries.values()]
+		return {
+			'count': len(entries),
+			'bytes': sum(entry['size'] for entry in entries),
+			'duration': sum(entry['duration'] for entry in entries if entry['duration'] is not None),
+			'unprobed': sum(1 for entry in entries if entry['duration'] is None),
+			'free': self.free,
+		}
+
+	def snapshot(self):
+		with self._lock:
+			entries = [self.describe(entry) for entry in self.entries.values()]
+		return {'reset': True, 'changes': entries, 'totals': self.totals(), 'warning': self.warning}
+
+	def getUpdates(self):
+		# only what changed since the last call; several changes to one capture collapse to the latest
+		changes = {}
+		while True:
+			try:
+				change = self.changes.get_nowait()
+			except queue.Empty:
+				break
+			changes[change['name']] = change
+
+		with self._lock:
+			warningChanged = self.warningChanged
+			self.warningChanged = False
+		if len(changes) == 0 and not warningChanged:
+			return None
+
+		update = {'changes': list(changes.values()), 'totals': self.totals()}
+		if warningChanged:
+			update['warning'] = self.warning
+		return update
+
+def essentialStreams(streams):
+	# the first video and audio streams are what a remux keeps; they have to match to be joined
+	essential = []
+	for codecType in ['video', 'audio']:
+		for stream in streams:
+			if stream.get('codec_type') == codecType:
+				essential.append(stream)
+				break
+	return essential
+
+def checkCompatible(captures, probeCache):
+	# refuse before any big I/O starts rather than after ffmpeg gives up
+	reference = None
+	for capture in captures:
+		streams = essentialStreams(probeCache.probe(capture)['streams'])
+		if reference is None:
+			reference = (capture, streams)
+		elif streams != reference[1]:
+			raise RuntimeError('%s has different codecs than %s (%s vs %s)' % (capture.name, reference[0].name, describeStreams(streams), describeStreams(reference[1])))
+
+def layoutMaps(streams, referenceStreams):
+	# the -map arguments that pick the reference layout out of a capture, or None if it doesn't carry it
+	maps = []
+	counts = {}
+	for stream in referenceStreams:
+		codecType = stream.get('codec_type', '')
+		index = counts.get(codecType, 0)
+		counts[codecType] = index + 1
+		candidates = [candidate for candidate in streams if candidate.get('codec_type') == codecType]
+		if index >= len(candidates) or candidates[index] != stream:
+			return None
+		maps += ['-map', '0:%s:%d' % (codecType[:1], index)]
+	return maps
+
+def needsNormalizing(info, referenceStreams):
+	return 'matroska' not in (info['format'] or '') or info['streams'] != referenceStreams
+
+def describeStreams(streams):
+	parts = []
+	for stream in streams:
+		if stream.get('codec_type') == 'video':
+			parts.append('%s %sx%s' % (stream.get('codec_name'), stream.get('width'), stream.get('height')))
+		else:
+			parts.append('%s %s' % (stream.get('codec_type'), stream.get('codec_name')))
+	return ', '.join(parts)
+
+def captureChapters(captures, probeCache):
+	chapters = []
+	start = 0
+	for capture in captures:
+		duration = probeCache.probe(capture)['duration']
+		markerData = loadMarkers(capture)
+		if markerData is None or len(markerData['markers']) == 0:
+			ranges = [(0, None)]
+		else:
+			ranges = keptRanges(markerData['markers'])
+
+		for rangeStart, rangeEnd in ranges:
+			length = max(0, (duration if rangeEnd is None else rangeEnd) - rangeStart)
+			chapters.append({'start': start, 'duration': length, 'title': 'Checkpoint %d' % (len(chapters) + 1)})
+			start += length
+
+	return chapters
+
+def groupSessions(captures, sessionGap, signature=None):
+	timed = sorted((captureTimes(c), c) for c in captures)
+
+	sessions = []
+	lastEnd = None
+	lastSignature = None
+	for (start, end), capture in timed:
+		captureSignature = signature(capture) if signature is not None else None
+		newSession = lastEnd is None or start - lastEnd > sessionGap
+		if captureSignature is not None and lastSignature is not None and captureSignature != lastSignature:
+			newSession = True
+
+		if newSession:
+			sessions.append([])
+		sessions[-1].append(capture)
+
+		lastEnd = max(end, lastEnd or end)
+		if captureSignature is not None:
+			lastSignature = captureSignature
+
+	return sessions
+
+class SessionCombineJob(CombineJob):
+	def __init__(self, videoPath, ffmpegPath, sessions=None, looseCaptures=None, maxWorkers=2, sessionGap=1800, encoder=None, alternateOutputPath=None):
+		super().__init__(videoPath, ffmpegPath, ffmpegSlots=threading.BoundedSemaphore(max(1, maxWorkers)), encoder=encoder, alternateOutputPath=alternateOutputPath)
+		self.sessions = [list(session) for session in (sessions or []) if len(session) > 0]
+		self.looseCaptures = looseCaptures
+		self.maxWorkers = max(1, maxWorkers)
+		self.sessionGap = sessionGap
+		self.children = []
+		self.outputs = []
+
+		self._progress = {}
+		self._progressLock = threading.Lock()
+
+	def cancel(self):
+		super().cancel()
+		for child in list(self.children):
+			child.cancel()
+
+	def run(self, report):
+		probeCache = ProbeCache.forVideoPath(self.ffmpegPath, self.videoPath)
+
+		# interrupted combines finish first, and their captures stay out of the new sessions
+		claimed = set()
+		for statePath in self.interruptedStates(self.videoPath):
+			state = self.loadState(statePath)
+			child = CombineJob(self.videoPath, self.ffmpegPath, outputFilePath=pathlib.Path(state['output']), probeCache=probeCache, statePath=statePath, ffmpegSlots=self.ffmpegSlots)
+			missing = self.missingInputs(state)
+			if len(missing) > 0:
+				report(message='Dropping the interrupted combine %s: %s no longer exists' % (pathlib.Path(state['output']).name, missing[0].name))
+				child.quarantineState()
+				continue
+			self.children.append(child)
+			for segment in state['segments']:
+				claimed.add(pathlib.Path(segment['source']))
+
+		sessions = [[c for c in session if c not in claimed] for session in self.sessions]
+		sessions = [session for session in sessions if len(session) > 0]
+
+		looseCaptures = self.looseCaptures
+		if looseCaptures is None:
+			grouped = set(c for session in self.sessions for c in session)
+			looseCaptures = [c for c in FileTools.findLooseCaptures(self.videoPath) if c not in grouped]
+		looseCaptures = [c for c in looseCaptures if c not in claimed]
+
+		try:
+			sessions += groupSessions(looseCaptures, self.sessionGap, probeCache.signature)
+		finally:
+			probeCache.save()
+		if len(sessions) == 0 and len(self.children) == 0:
+			raise RuntimeError('No loose videos to combine in %s' % self.videoPath)
+
+		if len(self.children) > 0:
+			report(message='Resuming %d interrupted combine(s)' % len(self.children))
+		report(message='Combining %d session(s) with up to %d workers' % (len(sessions), self.maxWorkers))
+		for session in sessions:
+			self.checkCancelled()
+			child = CombineJob(self.videoPath, self.ffmpegPath, session, self._sessionOutputPath(session), probeCache, ffmpegSlots=self.ffmpegSlots, encoder=self.encoder, alternateOutputPath=self.alternateOutputPath)
+			self.children.append(child)
+
+		failures = []
+		try:
+			self._runChildren(report, failures)
+		finally:
+			probeCache.save()
+
+		self.checkCancelled()
+		if len(self.outputs) == 1:
+			self.outputFilePath = self.outputs[0]
+		elif len(self.outputs) > 1:
+			self.outputFilePath = self.outputs[0].parent
+
+		if len(failures) > 0:
+			raise RuntimeError('%d of %d sessions failed:\n%s' % (len(failures), len(self.children), '\n'.join(failures)))
+
+	def _runChildren(self, report, failures):
+		with concurrent.futures.ThreadPoolExecutor(max_workers=self.maxWorkers) as pool:
+			# each worker supervises its own ffmpeg processes, and the shared ffmpegSlots cap them across sessions
+			futures = {pool.submit(child.run, self._childReporter(child, report)): child for child in self.children}
+			for future in concurrent.futures.as_completed(futures):
+				child = futures[future]
+				try:
+					future.result()
+					self.inputs += child.inputs
+					self.outputs.append(child.outputFilePath)
+					report(message='Finished %s' % child.outputFilePath.name)
+				except JobCancelled:
+					pass
+				except Exception as exc:
+					failures.append('%s: %s' % (child.outputFilePath.name if child.outputFilePath else child.id, exc))
+
+	def _sessionOutputPath(self, session):
+		start = datetime.fromtimestamp(captureTimes(session[0])[0]).strftime('%Y-%m-%d_%H-%M-%S')
+		outputFilePath = self.videoPath / f'combined/{start}-combined.mkv'
+
+		suffix = 1
+		taken = set(child.outputFilePath for child in self.children)
+		while outputFilePath.exists() or outputFilePath in taken:
+			suffix += 1
+			outputFilePath = self.videoPath / f'combined/{start}-combined-{suffix}.mkv'
+
+		return outputFilePath
+
+	def _childReporter(self, child, report):
+		def childReport(**details):
+			if 'progress' not in details:
+				report(**details)
+				return
+
+			with self._progressLock:
+				self._progress[child.id] = details['progress']
+				report(progress=combineProgress(list(self._progress.values())))
+
+		return childReport
+
+def combineProgress(snapshots):
+	combined = {
+		'bytes': sum(p['bytes'] for p in snapshots),
+		'expected_bytes': sum(p['expected_bytes'] for p in snapshots),
+		'out_time': sum(p['out_time'] for p in snapshots),
+		'rate': sum(p['rate'] for p in snapshots if not p['finished']),
+		'elapsed': max(p['elapsed'] for p in snapshots),
+		'finished': all(p['finished'] for p in snapshots),
+		'eta': None,
+		'percent': None,
+	}
+
+	speed = 0
+	for p in snapshots:
+		try:
+			speed += 0 if p['finished'] else float(p['speed'].rstrip('x'))
+		except ValueError:
+			pass
+	combined['speed'] = '%.1fx over %d' % (speed, len(snapshots))
+
+	if combined['expected_bytes'] > 0:
+		combined['percent'] = min(100.0, 100.0 * combined['bytes'] / combined['expected_bytes'])
+		if combined['rate'] > 0:
+			combined['eta'] = max(0, combined['expected_bytes'] - combined['bytes']) / combined['rate']
+
+	return combined
+
+class CombineJobQueue():
+	def __init__(self):
+		self.pending = queue.Queue()
+		self.statusUpdates = queue.Queue()
+		self.currentJob = None
+		self.worker = None
+		self._running = True
+
+	def submit(self, job):
+		self.pending.put(job)
+		self._report(job)
+
+		if self.worker is None or not self.worker.is_alive():
+			self.worker = threading.Thread(target=self._work, name='CombineJobQueue', daemon=True)
+			self.worker.start()
+
+		return job
+
+	def cancel(self, jobID=None):
+		job = self.currentJob
+		if job is not None and (jobID is None or job.id == jobID):
+			job.cancel()
+
+		# jobs that haven't started yet are skipped when the worker reaches them
+		with self.pending.mutex:
+			for queued in self.pending.queue:
+				if jobID is None or queued.id == jobID:
+					queued.cancel()
+
+	def shutdown(self):
+		self._running = False
+		self.cancel()
+		self.pending.put(None)
+
+	def isBusy(self):
+		return self.currentJob is not None or not self.pending.empty()
+
+	def getStatusUpdates(self):
+		updates = []
+		while True:
+			try:
+				updates.append(self.statusUpdates.get_nowait())
+			except queue.Empty:
+				return updates
+
+	def _report(self, job, **details):
+		status = {
+			'id': job.id,
+			'kind': job.kind,
+			'state': job.state.name,
+			'time': time.time(),
+		}
+		status.update(details)
+		self.statusUpdates.put(status)
+
+	def _work(self):
+		while self._running:
+			job = self.pending.get()
+			if job is None:
+				break
+
+			if job.isCancelled():
+				job.state = JobState.CANCELLED
+				self._report(job)
+				continue
+
+			self.currentJob = job
+			job.state = JobState.RUNNING
+			self._report(job)
+
+			try:
+				job.run(lambda **details: self._report(job, **details))
+				job.state = JobState.COMPLETE
+				self._report(job, output=str(job.outputFilePath), inputs=[str(p) for p in job.inputs])
+			except JobCancelled:
+				job.state = JobState.CANCELLED
+				self._report(job)
+			except Exception as exc:
+				job.error = exc
+				job.state = JobState.CANCELLED if job.isCancelled() else JobState.FAILED
+				self._report(job, message=str(exc))
+			finally:
+				self.currentJob = None
@@ -0,0 +1,368 @@
+# A stand-in for the obspython module OBS embeds, covering just what the scripts use.
+# Timers run when the host calls pump() between script ticks, and frontend events are
+# delivered from a thread of their own, the way OBS runs them on its UI thread; the
+# recording output writes its file from a thread and raises 'stop' from that thread
+# once the file is closed.
+import os
+import time
+import heapq
+import queue
+import traceback
+import pathlib
+import threading
+from datetime import datetime, timedelta
+
+OBS_FRONTEND_EVENT_STREAMING_STARTING = 0
+OBS_FRONTEND_EVENT_STREAMING_STARTED = 1
+OBS_FRONTEND_EVENT_STREAMING_STOPPING = 2
+OBS_FRONTEND_EVENT_STREAMING_STOPPED = 3
+OBS_FRONTEND_EVENT_RECORDING_STARTING = 4
+OBS_FRONTEND_EVENT_RECORDING_STARTED = 5
+OBS_FRONTEND_EVENT_RECORDING_STOPPING = 6
+OBS_FRONTEND_EVENT_RECORDING_STOPPED = 7
+OBS_FRONTEND_EVENT_EXIT = 17
+OBS_FRONTEND_EVENT_RECORDING_PAUSED = 28
+OBS_FRONTEND_EVENT_RECORDING_UNPAUSED = 29
+
+OBS_PROPERTY_INVALID = 0
+OBS_PROPERTY_BOOL = 1
+OBS_PROPERTY_INT = 2
+OBS_PROPERTY_FLOAT = 3
+OBS_PROPERTY_TEXT = 4
+OBS_PROPERTY_PATH = 5
+OBS_PROPERTY_LIST = 6
+OBS_PROPERTY_COLOR = 7
+OBS_PROPERTY_BUTTON = 8
+OBS_PROPERTY_FONT = 9
+
+OBS_TEXT_DEFAULT = 0
+OBS_PATH_FILE = 0
+OBS_PATH_FILE_SAVE = 1
+OBS_PATH_DIRECTORY = 2
+
+# settings data
+
+class FakeData():
+	def __init__(self):
+		self.values = {}
+		self.defaults = {}
+
+	def get(self, name, fallback):
+		if name in self.values:
+			return self.values[name]
+		return self.defaults.get(name, fallback)
+
+def obs_data_create():
+	return FakeData()
+
+def obs_data_release(data):
+	pass
+
+def obs_data_get_bool(data, name):
+	return bool(data.get(name, False))
+
+def obs_data_get_int(data, name):
+	return int(data.get(name, 0))
+
+def obs_data_get_double(data, name):
+	return float(data.get(name, 0.))
+
+def obs_data_get_string(data, name):
+	return str(data.get(name, ''))
+
+def obs_data_get_obj(data, name):
+	return data.get(name, None) or FakeData()
+
+def obs_data_set_default_bool(data, name, value):
+	data.defaults[name] = bool(value)
+
+def obs_data_set_default_int(data, name, value):
+	data.defaults[name] = int(value)
+
+def obs_data_set_default_double(data, name, value):
+	data.defaults[name] = float(value)
+
+def obs_data_set_default_string(data, name, value):
+	data.defaults[name] = str(value)
+
+def obs_data_set_bool(data, name, value):
+	data.values[name] = bool(value)
+
+def obs_data_set_int(data, name, value):
+	data.values[name] = int(value)
+
+def obs_data_set_double(data, name, value):
+	data.values[name] = float(value)
+
+def obs_data_set_string(data, name, value):
+	data.values[name] = str(value)
+
+def obs_data_set_obj(data, name, value):
+	data.values[name] = value
+
+# properties only need to be collected; nothing draws them
+
+def obs_properties_create():
+	return []
+
+def _addProperty(props, kind, name, description, *args):
+	props.append({'type': kind, 'name': name, 'description': description, 'args': args})
+
+def obs_properties_add_bool(props, name, description):
+	_addProperty(props, OBS_PROPERTY_BOOL, name, description)
+
+def obs_properties_add_int(props, name, description, minimum, maximum, step):
+	_addProperty(props, OBS_PROPERTY_INT, name, description, minimum, maximum, step)
+
+def obs_properties_add_float(props, name, description, minimum, maximum, step):
+	_addProperty(props, OBS_PROPERTY_FLOAT, name, description, minimum, maximum, step)
+
+def obs_properties_add_text(props, name, description, textType):
+	_addProperty(props, OBS_PROPERTY_TEXT, name, description, textType)
+
+def obs_properties_add_path(props, name, description, pathType, pathFilter, defaultPath):
+	_addProperty(props, OBS_PROPERTY_PATH, name, description, pathType, pathFilter, defaultPath)
+
+def obs_properties_add_color(props, name, description):
+	_addProperty(props, OBS_PROPERTY_COLOR, name, description)
+
+def obs_properties_add_font(props, name, description):
+	_addProperty(props, OBS_PROPERTY_FONT, name, description)
+
+def obs_properties_add_button(props, name, description, callback):
+	_addProperty(props, OBS_PROPERTY_BUTTON, name, description, callback)
+
+# signals
+
+class SignalHandler():
+	def __init__(self):
+		self.callbacks = {}
+		self._lock = threading.Lock()
+
+	def connect(self, signal, callback):
+		with self._lock:
+			self.callbacks.setdefault(signal, []).append(callback)
+
+	def emit(self, signal, calldata):
+		with self._lock:
+			callbacks = list(self.callbacks.get(signal, []))
+		for callback in callbacks:
+			callback(calldata)
+
+def signal_handler_connect(handler, signal, callback):
+	handler.connect(signal, callback)
+
+def calldata_int(calldata, name):
+	return int(calldata.get(name, 0))
+
+def calldata_string(calldata, name):
+	return str(calldata.get(name, ''))
+
+# timers are queued here and run by pump(); frontend events go to the UI thread
+
+_lock = threading.RLock()
+_timers = []
+_timerSequence = 0
+_frontendCallbacks = []
+_events = queue.Queue()
+_uiThread = None
+
+def timer_add(callback, milliseconds):
+	global _timerSequence
+	with _lock:
+		_timerSequence += 1
+		heapq.heappush(_timers, (time.monotonic() + milliseconds / 1000, _timerSequence, milliseconds, callback))
+
+def timer_remove(callback):
+	with _lock:
+		_timers[:] = [timer for timer in _timers if timer[3] is not callback]
+		heapq.heapify(_timers)
+
+def obs_frontend_add_event_callback(callback):
+	with _lock:
+		_frontendCallbacks.append(callback)
+
+def _deliverEvents():
+	while True:
+		event = _events.get()
+		with _lock:
+			callbacks = list(_frontendCallbacks)
+		for callback in callbacks:
+			try:
+				callback(event)
+			except Exception:
+				traceback.print_exc()
+		_events.task_done()
+
+def _queueEvent(event):
+	global _uiThread
+	with _lock:
+		if _uiThread is None:
+			_uiThread = threading.Thread(target=_deliverEvents, name='FrontendUI', daemon=True)
+			_uiThread.start()
+	_events.put(event)
+
+def pump():
+	# OBS timers repeat until removed
+	now = time.monotonic()
+	fired = 0
+	while True:
+		with _lock:
+			if len(_timers) == 0 or _timers[0][0] > now:
+				break
+			deadline, sequence, milliseconds, callback = heapq.heappop(_timers)
+			heapq.heappush(_timers, (now + milliseconds / 1000, sequence, milliseconds, callback))
+		callback()
+		fired += 1
+
+	return fired
+
+def shutdown():
+	recordingOutput.stop(wait=True)
+	_queueEvent(OBS_FRONTEND_EVENT_EXIT)
+	_events.join()
+	with _lock:
+		_frontendCallbacks.clear()
+		_timers.clear()
+
+# the recording output
+
+class RecordingOutput():
+	def __init__(self):
+		self.signalHandler = SignalHandler()
+		self.directory = pathlib.Path('.')
+		self.extension = '.mkv'
+
+		# how the fake behaves; hosts adjust these before starting a recording
+		self.startLatency = .05
+		self.stopLatency = .15
+		self.writeInterval = .05
+		self.bitrate = 250000
+		self.timeScale = 1.
+		# None writes filler with a header the stub ffprobe reads; a real ffmpeg needs a renderer
+		self.renderCapture = None
+		self.failNext = False
+
+		self.path = None
+		self.lastRecording = None
+		self.contentSeconds = 0
+		self.paused = False
+		self.active = False
+		self.simulatedClock = datetime.now()
+
+		self._lock = threading.Lock()
+		self._stopRequested = threading.Event()
+		self._writer = None
+
+	def isActive(self):
+		return self.active
+
+	def start(self):
+		with self._lock:
+			if self.active or self._writer is not None:
+				return False
+			self._stopRequested.clear()
+			self._writer = threading.Thread(target=self._record, name='RecordingOutput', daemon=True)
+			self._writer.start()
+		return True
+
+	def stop(self, wait=False):
+		self._stopRequested.set()
+		writer = self._writer
+		if wait and writer is not None:
+			writer.join()
+
+	def pause(self, paused):
+		if self.active and paused != self.paused:
+			self.paused = paused
+			_queueEvent(OBS_FRONTEND_EVENT_RECORDING_PAUSED if paused else OBS_FRONTEND_EVENT_RECORDING_UNPAUSED)
+
+	def _record(self):
+		_queueEvent(OBS_FRONTEND_EVENT_RECORDING_STARTING)
+		time.sleep(self.startLatency)
+
+		# OBS names captures after the time they start; simulated time keeps hours of takes apart
+		self.path = self.directory / (self.simulatedClock.strftime('%Y-%m-%d %H-%M-%S') + self.extension)
+		self.contentSeconds = 0
+		self.paused = False
+		self.active = True
+		_queueEvent(OBS_FRONTEND_EVENT_RECORDING_STARTED)
+
+		written = 0
+		with open(self.path, 'wb') as captureFile:
+			last = time.monotonic()
+			while True:
+				stopping = self._stopRequested.wait(self.writeInterval)
+				now = time.monotonic()
+				if not self.paused:
+					self.contentSeconds += (now - last) * self.timeScale
+				last = now
+
+				if self.renderCapture is None:
+					target = int(self.contentSeconds * self.bitrate)
+					captureFile.write(b'\0' * (target - written))
+					written = target
+				if stopping:
+					break
+
+			# the muxer takes a moment to finish the file after the output stops taking frames
+			_queueEvent(OBS_FRONTEND_EVENT_RECORDING_STOPPING)
+			time.sleep(self.stopLatency)
+			if self.renderCapture is None:
+				captureFile.seek(0)
+				captureFile.write(b'KROZSIM %.3f\n' % self.contentSeconds)
+
+		if self.renderCapture is not None:
+			# a real ffmpeg needs real video, so the content is rendered once the take is over
+			self.renderCapture(self.path, self.contentSeconds)
+
+		self.simulatedClock += timedelta(seconds=self.contentSeconds)
+		endTime = self.simulatedClock.timestamp()
+		os.utime(self.path, (endTime, endTime))
+		self.lastRecording = self.path
+
+		code = 0
+		if self.failNext:
+			self.failNext = False
+			code = -4
+
+		with self._lock:
+			self._writer = None
+			self.active = False
+			self.paused = False
+		self.signalHandler.emit('stop', {'code': code})
+		_queueEvent(OBS_FRONTEND_EVENT_RECORDING_STOPPED)
+
+recordingOutput = RecordingOutput()
+
+def obs_frontend_recording_start():
+	recordingOutput.start()
+
+def obs_frontend_recording_stop():
+	recordingOutput.stop()
+
+def obs_frontend_recording_active():
+	return recordingOutput.isActive()
+
+def obs_frontend_recording_paused():
+	return recordingOutput.isActive() and recordingOutput.paused
+
+def obs_frontend_recording_pause(paused):
+	recordingOutput.pause(paused)
+
+def obs_frontend_get_last_recording():
+	return '' if recordingOutput.lastRecording is None else str(recordingOutput.lastRecording)
+
+def obs_frontend_get_recording_output():
+	return recordingOutput
+
+def obs_output_get_signal_handler(output):
+	return output.signalHandler
+
+def obs_output_get_settings(output):
+	settings = FakeData()
+	settings.values['path'] = '' if output.path is None else str(output.path)
+	return settings
+
+def obs_output_release(output):
+	pass
@@ -0,0 +1,30 @@
+# A stand-in for system_hotkey: bindings are kept in a table and press() fires them
+# from a thread of their own, like the real listener does
+import threading
+
+class SystemHotkey():
+	bindings = {}
+
+	def __init__(self, *args, **kwargs):
+		pass
+
+	def register(self, bind, callback=None, overwrite=False):
+		bind = tuple(bind)
+		if bind in self.bindings and not overwrite:
+			raise ValueError('%s is already registered' % (bind,))
+		self.bindings[bind] = callback
+
+	def unregister(self, bind):
+		self.bindings.pop(tuple(bind), None)
+
+	def get_callback(self, bind):
+		return (self.bindings.get(tuple(bind)),)
+
+def press(bind):
+	callback = SystemHotkey.bindings.get(tuple(bind))
+	if callback is None:
+		return False
+
+	thread = threading.Thread(target=callback, args=(None,), name='SystemHotkey', daemon=True)
+	thread.start()
+	return True